@@ -0,0 +1,420 @@
+#!/usr/bin/env python
+"""
+Microbenchmarks of the session store.
+
+Measures ``SessionStore.encode``, ``decode``, ``save``, ``load`` and the
+resolution of a session key to its client (``RedisServer(key).get()``),
+sweeping session sizes, serializers, pool sizes, routers and key prefixes.
+Every case reports ops/sec, p50/p99 latency and, for the store operations,
+the bytes stored per session.
+
+The store operations run against a ``redis-server`` spawned on a free port
+(``--backend spawn``, the default), an already running server
+(``--backend url --url redis://...``) or fakeredis in process
+(``--backend fake``). Only compare results taken with the same backend.
+
+    python benchmarks/bench.py --output before.json
+    git checkout my-branch
+    python benchmarks/bench.py --output after.json --compare before.json
+
+Session contents are generated from a fixed seed, so two runs measure the
+same data.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+clock = getattr(time, 'perf_counter', time.time)
+
+SIZES = (100, 1000, 10000)
+QUICK_SIZES = (100, 1000)
+POOL_SIZES = (1, 4, 16)
+PREFIXES = ('', 'session')
+ROUTERS = ('modulo', 'ring')
+SERIALIZERS = (
+    ('json', 'django.contrib.sessions.serializers.JSONSerializer'),
+    ('pickle', 'django.contrib.sessions.serializers.PickleSerializer'),
+    ('msgpack', 'redis_sessions.serializers.MsgpackSerializer'),
+    ('orjson', 'redis_sessions.serializers.OrjsonSerializer'),
+)
+SEED = 2018
+
+
+def make_session(size, seed=SEED):
+    """Returns a session dict whose JSON form is about ``size`` bytes."""
+    rng = random.Random(seed + size)
+    session = {
+        '_auth_user_id': str(rng.randint(1, 10 ** 6)),
+        '_auth_user_backend': 'django.contrib.auth.backends.ModelBackend',
+    }
+    i = 0
+    while len(json.dumps(session)) < size:
+        value = ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz0123456789') for _ in range(rng.randint(4, 40)))
+        session['key_%d' % i] = rng.choice([value, rng.randint(0, 10 ** 9), [value, i], {'v': value}])
+        i += 1
+    return session
+
+
+def measure(func, iterations, warmup=None):
+    """Calls ``func`` ``iterations`` times, returns the sorted latencies."""
+    for _ in range(warmup if warmup is not None else max(iterations // 10, 1)):
+        func()
+    latencies = []
+    for _ in range(iterations):
+        started = clock()
+        func()
+        latencies.append(clock() - started)
+    latencies.sort()
+    return latencies
+
+
+def summarize(latencies):
+    total = sum(latencies)
+    return {
+        'iterations': len(latencies),
+        'ops_per_sec': round(len(latencies) / total, 1) if total else None,
+        'p50_us': round(percentile(latencies, 50) * 1e6, 2),
+        'p99_us': round(percentile(latencies, 99) * 1e6, 2),
+    }
+
+
+def percentile(latencies, p):
+    index = int(round(p / 100.0 * (len(latencies) - 1)))
+    return latencies[index]
+
+
+def case_id(case):
+    return case['name'] + ''.join(' %s=%s' % item for item in sorted(case['params'].items()))
+
+
+class Backend(object):
+    """Provides the redis connection settings, spawning a server if needed."""
+
+    def __init__(self, kind, url=None):
+        self.kind = kind
+        self.url = url
+        self.process = None
+        self.tmpdir = None
+
+    def start(self):
+        if self.kind == 'spawn':
+            executable = _which('redis-server')
+            if executable is None:
+                raise SystemExit("redis-server not found on PATH, use --backend url or --backend fake.")
+            import tempfile
+            port = _free_port()
+            self.tmpdir = tempfile.mkdtemp(prefix='redis-sessions-bench-')
+            self.process = subprocess.Popen(
+                [executable, '--port', str(port), '--bind', '127.0.0.1', '--save', '',
+                 '--appendonly', 'no', '--dir', self.tmpdir],
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            )
+            self.url = 'redis://127.0.0.1:%d/0' % port
+            self._wait()
+        elif self.kind == 'fake':
+            try:
+                import fakeredis  # noqa
+            except ImportError:
+                raise SystemExit("--backend fake requires fakeredis.")
+            self.url = 'redis://fake/0'
+        elif self.url is None:
+            raise SystemExit("--backend url requires --url.")
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+        if self.tmpdir is not None:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def install(self):
+        """Points the session store at the backend, once Django is set up."""
+        if self.kind != 'fake':
+            return
+        import fakeredis
+        from redis_sessions.session import RedisServer
+        server = fakeredis.FakeServer()
+
+        def connect(config, asyncio=False):
+            return fakeredis.FakeStrictRedis(server=server, db=config.options['db'])
+        RedisServer.connect = staticmethod(connect)
+
+    def pool(self, size):
+        """Returns a pool of ``size`` entries, spread over the databases of the server."""
+        base = self.url.rsplit('/', 1)[0]
+        return [{'url': '%s/%d' % (base, i % 16), 'db': i % 16} for i in range(size)]
+
+    def _wait(self):
+        import redis
+        client = redis.StrictRedis.from_url(self.url)
+        deadline = time.time() + 10
+        while True:
+            try:
+                client.ping()
+                return
+            except redis.ConnectionError:
+                if time.time() > deadline or self.process.poll() is not None:
+                    raise SystemExit("redis-server did not start.")
+                time.sleep(0.05)
+
+
+def _which(name):
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        candidate = os.path.join(directory, name)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
+
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def setup_django(backend):
+    from django.conf import settings
+    if not settings.configured:
+        settings.configure(
+            SECRET_KEY='benchmarks',
+            INSTALLED_APPS=['django.contrib.sessions', 'redis_sessions'],
+            SESSION_ENGINE='redis_sessions.session',
+            SESSION_REDIS={'url': backend.url, 'prefix': 'session'},
+        )
+    import django
+    if hasattr(django, 'setup'):
+        django.setup()
+
+
+def configure(backend, prefix='session', pool_size=None, router='modulo'):
+    from redis_sessions import settings as session_settings
+    from redis_sessions.session import RedisServer
+    session_settings.SESSION_REDIS_PREFIX = prefix
+    session_settings.SESSION_REDIS_POOL = backend.pool(pool_size) if pool_size else None
+    session_settings.SESSION_REDIS_POOL_ROUTER = router
+    RedisServer.reset()
+
+
+def available_serializers():
+    from django.core.exceptions import ImproperlyConfigured
+    from django.utils.module_loading import import_string
+    serializers = []
+    for name, path in SERIALIZERS:
+        try:
+            import_string(path)()
+        except (ImportError, ImproperlyConfigured):
+            # PickleSerializer was removed in Django 5.0, msgpack and orjson
+            # are optional.
+            continue
+        serializers.append((name, path))
+    return serializers
+
+
+def with_serializer(path):
+    from django.test.utils import override_settings
+    return override_settings(SESSION_SERIALIZER=path)
+
+
+def bench_codec(iterations, sizes):
+    from redis_sessions.session import SessionStore
+    results = []
+    for serializer, path in available_serializers():
+        with with_serializer(path):
+            for size in sizes:
+                store = SessionStore()
+                session = make_session(size)
+                encoded = store.encode(session)
+                params = {'serializer': serializer, 'size': size}
+                results.append(dict(
+                    summarize(measure(lambda: store.encode(session), iterations)),
+                    name='encode', params=params, bytes=len(encoded),
+                ))
+                results.append(dict(
+                    summarize(measure(lambda: store.decode(encoded), iterations)),
+                    name='decode', params=params, bytes=len(encoded),
+                ))
+    return results
+
+
+def bench_store(backend, iterations, sizes, pool_sizes):
+    from redis_sessions.session import SessionStore
+    results = []
+    for serializer, path in available_serializers():
+        with with_serializer(path):
+            for prefix in PREFIXES:
+                for pool_size in pool_sizes:
+                    configure(backend, prefix=prefix, pool_size=pool_size if pool_size > 1 else None)
+                    for size in sizes:
+                        results.extend(_bench_store_case(
+                            SessionStore, iterations, size,
+                            {'serializer': serializer, 'prefix': prefix, 'pool': pool_size, 'size': size},
+                        ))
+    configure(backend)
+    return results
+
+
+def _bench_store_case(store_class, iterations, size, params):
+    session = make_session(size)
+    # sessions saved and loaded in turn, so pools see every server.
+    stores = []
+    for _ in range(min(iterations, 200)):
+        store = store_class()
+        store.update(session)
+        store.save()
+        stores.append(store)
+    keys = [store.session_key for store in stores]
+    stored_bytes = _stored_bytes(stores[0])
+
+    counter = iter(range(10 ** 9))
+
+    def save():
+        store = stores[next(counter) % len(stores)]
+        store.modified = True
+        store.save()
+
+    def load():
+        store_class(keys[next(counter) % len(keys)]).load()
+
+    results = [
+        dict(summarize(measure(save, iterations)), name='save', params=params, bytes=stored_bytes),
+        dict(summarize(measure(load, iterations)), name='load', params=params, bytes=stored_bytes),
+    ]
+    store_class.delete_many(keys)
+    return results
+
+
+def _stored_bytes(store):
+    key = store.get_real_stored_key(store.session_key)
+    value = store.server.get(key)
+    return len(key.encode()) + len(value or b'')
+
+
+def bench_routing(backend, iterations, pool_sizes):
+    from redis_sessions.session import RedisServer, SessionStore
+    results = []
+    keys = [SessionStore()._get_new_session_key() for _ in range(1000)]
+    for router in ROUTERS:
+        for pool_size in pool_sizes:
+            if pool_size == 1 and router != ROUTERS[0]:
+                continue
+            configure(backend, pool_size=pool_size if pool_size > 1 else None, router=router)
+            counter = iter(range(10 ** 9))
+
+            def resolve():
+                RedisServer(keys[next(counter) % len(keys)]).get()
+
+            results.append(dict(
+                summarize(measure(resolve, iterations)),
+                name='get_server', params={'pool': pool_size, 'router': router},
+            ))
+    configure(backend)
+    return results
+
+
+def metadata(backend):
+    import django
+    import redis
+    meta = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'django': django.get_version(),
+        'redis_py': redis.__version__,
+        'backend': backend.kind,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+    try:
+        meta['commit'] = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.STDOUT,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    if backend.kind != 'fake':
+        import redis
+        info = redis.StrictRedis.from_url(backend.url).info('server')
+        meta['redis_server'] = info.get('redis_version')
+    return meta
+
+
+def print_results(results):
+    print('%-60s %12s %10s %10s %8s' % ('case', 'ops/sec', 'p50 us', 'p99 us', 'bytes'))
+    for case in results:
+        print('%-60s %12s %10s %10s %8s' % (
+            case_id(case), case['ops_per_sec'], case['p50_us'], case['p99_us'], case.get('bytes', ''),
+        ))
+
+
+def print_comparison(baseline, results):
+    """Prints the change of every case of ``results`` against ``baseline``."""
+    if baseline['meta'].get('backend') != results['meta'].get('backend'):
+        print("warning: comparing results of different backends.")
+    before = dict((case_id(case), case) for case in baseline['results'])
+    print('%-60s %12s %12s %8s %10s' % ('case', 'base ops/s', 'ops/s', 'change', 'p99 change'))
+    for case in results['results']:
+        old = before.get(case_id(case))
+        if old is None or not old['ops_per_sec']:
+            continue
+        print('%-60s %12s %12s %+7.1f%% %+9.1f%%' % (
+            case_id(case), old['ops_per_sec'], case['ops_per_sec'],
+            (case['ops_per_sec'] / old['ops_per_sec'] - 1) * 100,
+            (case['p99_us'] / old['p99_us'] - 1) * 100 if old['p99_us'] else 0,
+        ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--backend', choices=('spawn', 'url', 'fake'), default='spawn')
+    parser.add_argument('--url', help="redis URL for --backend url.")
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--quick', action='store_true', help="fewer sizes and pool sizes.")
+    parser.add_argument('--only', choices=('codec', 'store', 'routing'), action='append',
+                        help="run only these groups, can be repeated.")
+    parser.add_argument('--output', help="write the results to this JSON file.")
+    parser.add_argument('--compare', help="compare with the results of a previous --output.")
+    args = parser.parse_args(argv)
+
+    sizes = QUICK_SIZES if args.quick else SIZES
+    pool_sizes = POOL_SIZES[:2] if args.quick else POOL_SIZES
+    groups = args.only or ['codec', 'store', 'routing']
+
+    backend = Backend(args.backend, args.url)
+    backend.start()
+    try:
+        setup_django(backend)
+        backend.install()
+        results = []
+        if 'codec' in groups:
+            results.extend(bench_codec(args.iterations, sizes))
+        if 'store' in groups:
+            results.extend(bench_store(backend, args.iterations, sizes, pool_sizes))
+        if 'routing' in groups:
+            results.extend(bench_routing(backend, args.iterations * 10, pool_sizes))
+        report = {'meta': metadata(backend), 'results': results}
+    finally:
+        backend.stop()
+
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            print()
+            print_comparison(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
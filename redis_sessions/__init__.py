@@ -1 +1,10 @@
 __version__ = '0.6.1'
+
+# Django >= 3.2 finds the AppConfig by itself.
+try:
+    import django
+except ImportError:
+    pass
+else:
+    if django.VERSION < (3, 2):
+        default_app_config = 'redis_sessions.apps.RedisSessionsConfig'
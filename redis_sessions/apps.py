@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+
+from redis_sessions import settings
+
+
+class RedisSessionsConfig(AppConfig):
+    name = 'redis_sessions'
+    verbose_name = 'Redis sessions'
+
+    def ready(self):
+        if settings.SESSION_REDIS_PREWARM:
+            from redis_sessions.session import RedisServer
+            RedisServer.prewarm(settings.SESSION_REDIS_PREWARM)
@@ -0,0 +1,419 @@
+"""
+Redis session store with native async methods, for async views under ASGI
+(Django >= 5.0 and redis-py >= 4.2).
+
+It stores sessions exactly like ``redis_sessions.session``, so both stores
+can share a keyspace. Set ``SESSION_ENGINE = 'redis_sessions.async_session'``.
+"""
+from django.conf import settings as django_settings
+from django.contrib.sessions.backends.base import CreateError
+
+from redis_sessions import settings
+from redis_sessions.metrics import record_create_retry, record_load, record_save, timed
+from redis_sessions.near_cache import get_near_cache, get_recent_writes
+from redis_sessions.write_behind import get_write_behind
+from redis_sessions.session import (
+    HASH_MARKER, HASH_SAVE_SCRIPT, VERSIONED_SAVE_SCRIPT, RedisServer, SessionStore as SyncSessionStore,
+    _check_restored, _missing, _new_version, _no_getex, _remaining, logger,
+)
+import hashlib
+import time
+
+import redis
+
+_async_scripts = {}
+
+
+class SessionStore(SyncSessionStore):
+    """
+    Implements Redis database session store, with async methods backed by
+    ``redis.asyncio`` clients. ``acycle_key`` and the other async helpers of
+    SessionBase build on the methods below.
+    """
+    @property
+    def async_server(self):
+        # resolved on use: async clients are bound to the running event loop.
+        return self._route(self._session_key).get_async()
+
+    @staticmethod
+    def get_async_redis_server(session_key):
+        return RedisServer(session_key).get_async()
+
+    def _async_script(self, source):
+        script = _async_scripts.get(source)
+        if script is None:
+            script = _async_scripts[source] = self.async_server.register_script(source)
+        return script
+
+    async def _afetch(self, key):
+        stored = self._pending(key)
+        if stored is not None:
+            return stored, None, None
+        near_cache = get_near_cache()
+        entry = await self._acached(near_cache, key) if near_cache is not None else None
+        if entry is not None:
+            return entry[1], None, entry[2]
+
+        client = self.async_server if settings.SESSION_REDIS_SLIDING_EXPIRY else self._async_read_client(key)
+        version_key = self._version_key(key) if near_cache is not None else None
+        stored, expires_at, version = await self._aread(client, key, version_key)
+        if not stored and client is not self.async_server:
+            stored, expires_at, version = await self._aread(self.async_server, key, version_key)
+        if not stored and await self._amigrate(key):
+            stored, expires_at, version = await self._aread(self.async_server, key, version_key)
+
+        unpacked = None
+        if stored and near_cache is not None:
+            unpacked = self._unpack_stored(stored)
+            if unpacked is not None and self._cacheable(stored):
+                near_cache.set(key, (version, stored, unpacked))
+        return stored or None, expires_at, unpacked
+
+    async def _acached(self, near_cache, key):
+        entry = near_cache.get(key)
+        if entry is None or not near_cache.verify:
+            return entry
+        try:
+            if settings.SESSION_REDIS_STORAGE == 'hash':
+                current = await self.async_server.hget(key, HASH_MARKER)
+            else:
+                pipe = self.async_server.pipeline(transaction=False)
+                current, exists = await pipe.get(self._version_key(key)).exists(key).execute()
+                if not exists:
+                    current = _missing
+        except redis.ResponseError:
+            current = _missing
+        if current != entry[0]:
+            near_cache.delete(key)
+            return None
+        return entry
+
+    async def _amigrate(self, key):
+        previous = self._route().get_previous_async()
+        if previous is None:
+            return False
+        try:
+            dumped, pttl = await previous.pipeline(transaction=False).dump(key).pttl(key).execute()
+            if dumped is None or pttl == -2:
+                return False
+            pipe = self.async_server.pipeline(transaction=False).restore(key, max(pttl, 0), dumped)
+            _check_restored(await pipe.execute(raise_on_error=False))
+            if settings.SESSION_REDIS_USER_INDEX:
+                await self._amove_index(previous, key)
+            await previous.delete(key)
+            return True
+        except redis.RedisError as e:
+            logger.warning("Could not move session from its previous redis server: %s", e)
+            return False
+
+    async def _amove_index(self, previous, key):
+        """Async counterpart of ``_move_index`` for this session."""
+        index = self._moved_index((await self._aread(previous, key))[0])
+        if index is None:
+            return
+        index_key, age = index
+        await self.async_server.pipeline(transaction=False).sadd(index_key, self.session_key).expire(
+            index_key, age).execute()
+        await previous.srem(index_key, self.session_key)
+
+    async def _aread(self, client, key, version_key=None):
+        hash_storage = settings.SESSION_REDIS_STORAGE == 'hash'
+        expires_at = version = None
+        try:
+            if version_key is not None:
+                stored, expires_at, version = await self._aread_versioned(client, key, version_key)
+            elif settings.SESSION_REDIS_SLIDING_EXPIRY:
+                stored = await self._aread_sliding(client, key, hash_storage)
+                expires_at = time.time() + django_settings.SESSION_COOKIE_AGE
+            elif settings.SESSION_REDIS_DIRTY_TRACKING:
+                pipe = client.pipeline(transaction=False)
+                if hash_storage:
+                    pipe.hgetall(key)
+                else:
+                    pipe.get(key)
+                stored, ttl = await pipe.ttl(key).execute()
+                if ttl is not None and ttl >= 0:
+                    expires_at = time.time() + ttl
+            elif hash_storage:
+                stored = await client.hgetall(key)
+            else:
+                stored = await client.get(key)
+        except redis.ResponseError:
+            if not hash_storage:
+                raise
+            stored = await client.get(key)
+        if isinstance(stored, dict):
+            version = stored.get(HASH_MARKER)
+        return stored, expires_at, version
+
+    @staticmethod
+    async def _aread_versioned(client, key, version_key):
+        pipe = client.pipeline(transaction=False).get(version_key).get(key)
+        if settings.SESSION_REDIS_SLIDING_EXPIRY:
+            age = django_settings.SESSION_COOKIE_AGE
+            version, stored, _ = await pipe.expire(key, age).execute()
+            return stored, time.time() + age, version
+        if settings.SESSION_REDIS_DIRTY_TRACKING:
+            version, stored, ttl = await pipe.ttl(key).execute()
+            return stored, time.time() + ttl if ttl is not None and ttl >= 0 else None, version
+        version, stored = await pipe.execute()
+        return stored, None, version
+
+    @staticmethod
+    async def _aread_sliding(client, key, hash_storage):
+        age = django_settings.SESSION_COOKIE_AGE
+        if not hash_storage and id(client) not in _no_getex:
+            try:
+                return await client.execute_command('GETEX', key, 'EX', age)
+            except redis.ResponseError as e:
+                if 'unknown command' not in str(e).lower():
+                    raise
+                _no_getex.add(id(client))
+        pipe = client.pipeline(transaction=False)
+        if hash_storage:
+            pipe.hgetall(key)
+        else:
+            pipe.get(key)
+        return (await pipe.expire(key, age).execute())[0]
+
+    def _async_read_client(self, key, session_key=None):
+        recent_writes = get_recent_writes()
+        server = self._route(session_key)
+        if recent_writes is None or self.written_recently or recent_writes.get(key) is not None:
+            return server.get_async()
+        return server.get_replica_async()
+
+    async def aload(self):
+        with timed('load', self):
+            try:
+                key = self.get_real_stored_key(await self._aget_or_create_session_key())
+                with self.guard(self.session_key):
+                    fetched = await self._afetch(key)
+                    if fetched[0] is None and settings.SESSION_REDIS_MIGRATE_FROM is not None:
+                        session = await self._aload_legacy()
+                        if session is not None:
+                            return session
+                session = self._load_stored(*fetched)
+                age = self._sliding_correction(session, fetched[1])
+                if age is not None:
+                    await self.async_server.expire(key, age)
+                return session
+            except (redis.ConnectionError, redis.TimeoutError) as e:
+                self._load_failed(e)
+                return await self._aload_missing()
+            except Exception:
+                return await self._aload_missing()
+
+    async def _aload_missing(self):
+        session_key, self._session_key = self._session_key, None
+        session = await self._fallback_store(session_key).aload() if self._fallback_engine() else {}
+        if session:
+            self.modified = True
+        return session
+
+    async def _aload_legacy(self):
+        legacy = self._legacy_store(self.session_key)
+        get_row = getattr(legacy, '_aget_session_from_db', None)
+        if get_row is None:
+            session, ttl = await legacy.aload(), legacy.get_expiry_age()
+        else:
+            row = await get_row()
+            session, ttl = (legacy.decode(row.session_data), _remaining(row.expire_date)) if row else ({}, 0)
+        if not session or ttl <= 0:
+            return None
+        pipe = self._pipeline(self.async_server)
+        await self._import(pipe, session, ttl).execute()
+        record_load(self, 'migrated')
+        if settings.SESSION_REDIS_MIGRATE_DELETE:
+            await legacy.adelete()
+        return session
+
+    async def aexists(self, session_key):
+        with timed('exists', self):
+            try:
+                with self.guard(session_key):
+                    key = self.get_real_stored_key(session_key)
+                    return bool(await self._async_read_client(key, session_key).exists(key))
+            except (redis.ConnectionError, redis.TimeoutError):
+                if settings.SESSION_REDIS_FALLBACK is None:
+                    raise
+                return False
+
+    async def acreate(self):
+        while True:
+            self._session_key = await self._aget_new_session_key()
+            self.server = self._route().get()
+
+            with timed('create', self):
+                try:
+                    await self.asave(must_create=True)
+                except CreateError:
+                    # Key wasn't unique. Try again.
+                    record_create_retry(self)
+                    continue
+                await self._aprune_index()
+            self.modified = True
+            return
+
+    async def _aprune_index(self):
+        index_key = self._user_index_key()
+        if index_key is None:
+            return
+        try:
+            with self.guard(self.session_key):
+                session_keys = list(await self.async_server.smembers(index_key))
+                pipe = self.async_server.pipeline(transaction=False)
+                for session_key in session_keys:
+                    pipe.exists(self.get_real_stored_key(session_key.decode()))
+                gone = [session_key for session_key, exists in zip(session_keys, await pipe.execute()) if not exists]
+                if gone:
+                    await self.async_server.srem(index_key, *gone)
+        except redis.RedisError as e:
+            logger.warning("Could not prune the user index: %s", e)
+
+    async def asave(self, must_create=False):
+        if self.session_key is None:
+            return await self.acreate()
+        with timed('save', self):
+            try:
+                with self.guard(self.session_key):
+                    await self._asave(must_create)
+            except (redis.ConnectionError, redis.TimeoutError):
+                if settings.SESSION_REDIS_FALLBACK is None:
+                    raise
+                await self._afallback_save(getattr(self, '_session_cache', {}))
+
+    async def _afallback_save(self, session):
+        if self._fallback_engine() is None:
+            return
+        fallback = self._fallback_store()
+        fallback._session_cache = session
+        await fallback.asave()
+        self._session_key = fallback.session_key
+
+    async def _asave(self, must_create):
+        key = self.get_real_stored_key(await self._aget_or_create_session_key())
+        # once loaded, the session is in memory and the sync helpers below
+        # do no I/O.
+        session = await self._aget_session(no_load=must_create)
+        if settings.SESSION_REDIS_STORAGE == 'hash':
+            return await self._asave_fields(key, session, must_create)
+
+        serialized = self.serializer().dumps(session)
+        fingerprint = hashlib.sha1(serialized).digest()
+        if (not must_create and self._dirty_tracking()
+                and fingerprint == self._fingerprint and await self._atouch(key)):
+            return
+
+        data = self._pack(serialized)
+        record_save(self, len(data))
+        index_key = self._user_index_key()
+        version = _new_version() if not must_create and get_near_cache() is not None else None
+        if must_create:
+            created = await self.async_server.set(key, data, ex=self.get_expiry_age(), nx=True)
+            if not created:
+                raise CreateError
+            if index_key is not None:
+                await self._index_pipeline(self._pipeline(self.async_server), index_key).execute()
+        elif settings.SESSION_REDIS_VERSIONED:
+            return await self._asave_versioned(key, data, fingerprint, serialized, version)
+        elif self._save_behind(key, data, index_key, version):
+            # written by the write-behind thread, with the sync client.
+            pass
+        elif index_key is not None or version is not None:
+            pipe = self._pipeline(self.async_server)
+            pipe.setex(key, self.get_expiry_age(), data)
+            if index_key is not None:
+                self._index_pipeline(pipe, index_key)
+            if version is not None:
+                self._version_pipeline(pipe, key, version)
+            await pipe.execute()
+        else:
+            await self.async_server.setex(key, self.get_expiry_age(), data)
+        self._saved(key, data, fingerprint, version, serialized)
+
+    async def _asave_versioned(self, key, data, fingerprint, serialized, version=None):
+        save = self._async_script(VERSIONED_SAVE_SCRIPT)
+        keys = self._field_keys(key)
+        for retry in range(settings.SESSION_REDIS_VERSIONED_RETRIES + 1):
+            args = self._versioned_args(data, retry)
+            written = await save(keys=keys, args=args, client=self.async_server)
+            if written[0]:
+                break
+            data, fingerprint, serialized = self._merge(written[1])
+        pipe = self._after_versioned_save(self.async_server, key, version)
+        if pipe is not None:
+            await pipe.execute()
+        self._saved(key, data, fingerprint, version, serialized)
+
+    async def _asave_fields(self, key, session, must_create):
+        mode, args, fields = self._field_changes(session, must_create)
+        if mode is None:
+            if await self._atouch(key):
+                return
+            mode = 'update'
+
+        save = self._async_script(HASH_SAVE_SCRIPT)
+        keys = self._field_keys(key)
+        if not await save(keys=keys, args=[mode] + args, client=self.async_server):
+            if mode == 'create':
+                raise CreateError
+            await save(keys=keys, args=['replace'] + self._field_args(session), client=self.async_server)
+        index_key = self._separate_index_key()
+        if index_key is not None:
+            await self._index_pipeline(self._pipeline(self.async_server), index_key).execute()
+        self._fields_saved(key, fields)
+
+    async def _atouch(self, key):
+        if self._expiry_within_slack():
+            return True
+        index_key = self._user_index_key()
+        if index_key is None:
+            touched = await self.async_server.expire(key, self.get_expiry_age())
+        else:
+            pipe = self._pipeline(self.async_server)
+            pipe.expire(key, self.get_expiry_age())
+            touched = (await self._index_pipeline(pipe, index_key).execute())[0]
+        if not touched:
+            return False
+        self._expires_at = time.time() + self.get_expiry_age()
+        return True
+
+    async def _adeleted_index_key(self, session_key, key):
+        if not settings.SESSION_REDIS_USER_INDEX:
+            return None
+        session = getattr(self, '_session_cache', None) if session_key == self.session_key else None
+        if session is None:
+            stored = (await self._aread(self._route(session_key).get_async(), key))[0]
+            session = self._stored_session(stored)
+        return self._session_index_key(session)
+
+    async def adelete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        key = self.get_real_stored_key(session_key)
+        near_cache = get_near_cache()
+        if near_cache is not None:
+            near_cache.delete(key)
+        queue = get_write_behind()
+        if queue is not None:
+            queue.discard(key)
+        self._written(key)
+        with timed('delete', self):
+            try:
+                with self.guard(session_key):
+                    server = self._route(session_key).get_async()
+                    index_key = await self._adeleted_index_key(session_key, key)
+                    if index_key is None:
+                        await server.delete(key)
+                    else:
+                        await self._pipeline(server).delete(key).srem(index_key, session_key).execute()
+                previous = self._route(session_key).get_previous_async()
+                if previous is not None:
+                    await previous.delete(key)
+                if settings.SESSION_REDIS_MIGRATE_FROM is not None:
+                    await self._legacy_store(session_key).adelete(session_key)
+            except Exception:
+                pass
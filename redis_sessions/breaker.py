@@ -0,0 +1,82 @@
+"""
+Circuit breaker of a Redis server.
+
+After ``threshold`` consecutive connection errors or timeouts the circuit
+opens and the server is not called for ``cooldown`` seconds: operations
+fail at once with ``CircuitOpenError``. Then a single probe operation is let
+through, its success closes the circuit, its failure opens it again.
+"""
+import threading
+import time
+
+import redis
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(redis.ConnectionError):
+    """Raised instead of calling a server whose circuit is open."""
+
+
+class CircuitBreaker(object):
+    """
+    Context manager guarding the operations of one server. Connection errors
+    and timeouts raised in the block count as failures, anything else
+    (including other redis errors) as a success.
+    """
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Returns True if an operation may call the server."""
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            if self.state == OPEN and time.time() - self.opened_at >= self.cooldown:
+                # this caller is the probe, the others keep failing fast.
+                self.state = HALF_OPEN
+                return True
+            return self.state == CLOSED
+
+    def success(self):
+        if self.state != CLOSED or self.failures:
+            with self._lock:
+                self.state = CLOSED
+                self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.threshold:
+                self.state = OPEN
+                self.opened_at = time.time()
+
+    def __enter__(self):
+        if not self.allow():
+            raise CircuitOpenError("circuit open, redis server not called.")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and issubclass(exc_type, (redis.ConnectionError, redis.TimeoutError)):
+            self.failure()
+        else:
+            self.success()
+        return False
+
+
+class _NullBreaker(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+null_breaker = _NullBreaker()
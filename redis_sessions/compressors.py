@@ -0,0 +1,144 @@
+"""
+Payload compressors for the binary session format.
+
+Every compressor has a ``codec`` id which is written in the header of the
+stored value, so sessions compressed with different codecs (or not at all)
+can be decoded side by side. Ids below 16 are reserved for this package.
+"""
+from collections import Counter
+import re
+import struct
+import zlib
+
+from django.utils.module_loading import import_string
+
+from redis_sessions import settings
+
+# CMF and FLG bytes starting a zlib stream; FDICT is set in FLG when it was
+# compressed with a preset dictionary.
+ZLIB_HEADER = struct.Struct('!BB')
+ZLIB_FDICT = 0x20
+
+
+class BaseCompressor(object):
+    codec = None
+
+    def compress(self, data):
+        raise NotImplementedError
+
+    def decompress(self, data):
+        raise NotImplementedError
+
+
+class ZlibCompressor(BaseCompressor):
+    """
+    zlib compressor, optionally primed with a preset dictionary.
+
+    ``dictionary`` is either the dictionary bytes or a path to a file holding
+    them, see ``train_dictionary``. zlib records the Adler-32 checksum of the
+    dictionary in the stream, so values compressed with earlier dictionaries
+    stay readable while these are listed in ``previous_dictionaries``.
+    Preset dictionaries require Python 3.3+.
+    """
+    codec = 1
+    dictionary_codec = 2
+
+    def __init__(self, level=6, dictionary=None, previous_dictionaries=()):
+        self.level = level
+        self.dictionary = _read_dictionary(dictionary)
+        if self.dictionary:
+            self.codec = self.dictionary_codec
+        dictionaries = [_read_dictionary(d) for d in previous_dictionaries] + [self.dictionary]
+        self.dictionaries = dict((zlib.adler32(d) & 0xffffffff, d) for d in dictionaries if d)
+
+    def compress(self, data):
+        if self.dictionary:
+            compressor = zlib.compressobj(self.level, zdict=self.dictionary)
+        else:
+            compressor = zlib.compressobj(self.level)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data):
+        _, flags = ZLIB_HEADER.unpack_from(data)
+        if flags & ZLIB_FDICT:
+            # the header is followed by the id of the dictionary.
+            dictionary_id = struct.unpack_from('!I', data, ZLIB_HEADER.size)[0]
+            dictionary = self.dictionaries.get(dictionary_id)
+            if dictionary is None:
+                raise ValueError(
+                    "session compressed with an unknown zlib dictionary (id %08x), "
+                    "list it in the previous_dictionaries compressor option." % dictionary_id
+                )
+            decompressor = zlib.decompressobj(zdict=dictionary)
+        else:
+            decompressor = zlib.decompressobj()
+        return decompressor.decompress(data) + decompressor.flush()
+
+
+def _read_dictionary(dictionary):
+    if dictionary is not None and not isinstance(dictionary, bytes):
+        with open(dictionary, 'rb') as f:
+            return f.read()
+    return dictionary
+
+
+_compressors = {}
+
+
+def get_compressor():
+    """Returns the configured compressor, or None if compression is disabled."""
+    path = settings.SESSION_REDIS_COMPRESSOR
+    if path is None:
+        return None
+    options = settings.SESSION_REDIS_COMPRESSOR_OPTIONS
+    cache_key = (path, repr(sorted(options.items())))
+    if cache_key not in _compressors:
+        _compressors[cache_key] = import_string(path)(**options)
+    return _compressors[cache_key]
+
+
+def get_decompressor(codec):
+    """Returns a compressor able to decompress values stored with ``codec``."""
+    compressor = get_compressor()
+    if codec in (ZlibCompressor.codec, ZlibCompressor.dictionary_codec):
+        return _zlib_decompressor(compressor)
+    if compressor is not None and compressor.codec == codec:
+        return compressor
+    raise ValueError("unknown session codec %r." % codec)
+
+
+def _zlib_decompressor(compressor):
+    # the previous_dictionaries setting is read whatever the active compressor.
+    dictionaries = tuple(settings.SESSION_REDIS_PREVIOUS_DICTIONARIES)
+    if isinstance(compressor, ZlibCompressor):
+        if not dictionaries:
+            return compressor
+        dictionaries += tuple(compressor.dictionaries.values())
+    cache_key = (ZlibCompressor, dictionaries)
+    if cache_key not in _compressors:
+        _compressors[cache_key] = ZlibCompressor(previous_dictionaries=dictionaries)
+    return _compressors[cache_key]
+
+
+def train_dictionary(samples, size=16 * 1024):
+    """
+    Builds a zlib preset dictionary from sampled session payloads.
+
+    The dictionary is made of the fragments (keys, values, punctuation runs)
+    shared by several samples, the most common ones last, since zlib finds
+    matches near the end of the dictionary more cheaply.
+    """
+    counts = Counter()
+    for sample in samples:
+        counts.update(set(re.findall(br'[^\s"\':,{}\[\]]{2,}|[\s"\':,{}\[\]]+', sample)))
+
+    fragments = [
+        fragment for fragment, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+        if count > 1
+    ]
+    dictionary = b''
+    for fragment in fragments:
+        if len(dictionary) + len(fragment) > size:
+            break
+        dictionary = fragment + dictionary
+    return dictionary
@@ -0,0 +1,234 @@
+"""
+Keyspace maintenance: walks the session keys of every configured server with
+SCAN and deletes the ones matching some criteria, in UNLINK batches, or moves
+the ones a pool change gave another server; and imports the sessions of the
+``migrate_from`` engine.
+"""
+from importlib import import_module
+import re
+import time
+
+from django.utils import timezone
+
+from redis_sessions import settings
+from redis_sessions.session import VERSION_KEY_SUFFIX, RedisServer, _move, _remaining, _unlink
+
+# the types of the keys holding sessions, with the string and hash storages.
+SESSION_TYPES = (b'string', b'hash')
+# scanned keys are bytes.
+VERSION_SUFFIX = VERSION_KEY_SUFFIX.encode()
+
+
+def session_pattern(store):
+    """
+    Returns the SCAN pattern matching the session keys of ``store``. Raises
+    ValueError without a ``prefix``: it would match every key of the
+    database, sessions or not.
+    """
+    prefix = settings.SESSION_REDIS_PREFIX
+    if not prefix:
+        raise ValueError("SESSION_REDIS['prefix'] is not set, session keys cannot be told from other keys.")
+    # glob characters in the prefix are matched literally.
+    return re.sub(r'([\\\[\]*?])', r'\\\1', prefix) + store.get_real_stored_key('*')[len(prefix):]
+
+
+def sweep(store_class, no_ttl=False, undecodable=False, predicate=None, dry_run=False,
+          batch_size=500, rate=None, report=None):
+    """
+    Deletes the session keys that have no expiry (``no_ttl``), that cannot be
+    decoded (``undecodable``) or for which ``predicate(session_key, session)``
+    is true, on every configured server and on the servers of
+    ``previous_pool`` that are not in the current pool.
+
+    Keys are scanned and deleted ``batch_size`` at a time, examining at most
+    ``rate`` keys per second. With ``dry_run`` nothing is deleted.
+    ``report(connection_key, scanned, matched)`` is called after each batch.
+
+    Returns the number of matched keys.
+    """
+    store = store_class()
+    pattern = session_pattern(store)
+    started, examined, matched = time.time(), 0, 0
+
+    for connection_key, client in RedisServer.get_all() + RedisServer.get_all_retired():
+        scanned = server_matched = 0
+        for batch in _scan(client, pattern, batch_size):
+            doomed = _select(store, client, batch, no_ttl, undecodable, predicate)
+            if doomed and not dry_run:
+                _unlink(client, doomed)
+            scanned += len(batch)
+            server_matched += len(doomed)
+            if report is not None:
+                report(connection_key, scanned, server_matched)
+
+            examined += len(batch)
+            _throttle(started, examined, rate)
+        matched += server_matched
+    return matched
+
+
+def rebalance(store_class, dry_run=False, batch_size=500, rate=None, report=None):
+    """
+    Moves the session keys of the servers of ``previous_pool`` to their
+    server in the current pool, with DUMP/RESTORE pipelines keeping their
+    remaining TTL. Keys already written on their new server are kept there.
+
+    Same batching, rate limiting and reporting as ``sweep``. Returns the
+    number of keys moved, or that would be moved with ``dry_run``.
+    """
+    store = store_class()
+    pattern = session_pattern(store)
+    started, examined, moved = time.time(), 0, 0
+
+    for connection_key, client in RedisServer.get_all_previous():
+        scanned = server_moved = 0
+        for batch in _scan(client, pattern, batch_size):
+            targets = {}
+            for key in _sessions(client, batch):
+                server = RedisServer(store.get_session_key(key.decode()))
+                if server.connection_key != connection_key:
+                    targets.setdefault(server.connection_key, (server, []))[1].append(key)
+            for server, keys in targets.values():
+                server_moved += len(keys) if dry_run else _move(store, client, server.get(), keys)
+            scanned += len(batch)
+            if report is not None:
+                report(connection_key, scanned, server_moved)
+
+            examined += len(batch)
+            _throttle(started, examined, rate)
+        moved += server_moved
+    return moved
+
+
+def import_legacy(store_class, delete=False, dry_run=False, batch_size=500, rate=None, report=None):
+    """
+    Copies the unexpired sessions of the ``migrate_from`` database engine
+    to redis with their remaining expiry, streaming its rows ``batch_size``
+    at a time into one pipeline per server. Sessions already in redis are
+    left as they are. With ``delete`` the copied rows are deleted.
+
+    Same rate limiting as ``sweep``, ``report(scanned, imported)`` is called
+    after each batch. Returns the number of sessions imported, or that would
+    be with ``dry_run``.
+    """
+    legacy = import_module(settings.SESSION_REDIS_MIGRATE_FROM).SessionStore()
+    model = getattr(legacy, 'model', None)
+    if model is None:
+        raise ValueError("%s does not store sessions in the database." % settings.SESSION_REDIS_MIGRATE_FROM)
+
+    rows = model.objects.filter(expire_date__gt=timezone.now()).values_list(
+        'session_key', 'session_data', 'expire_date')
+    started, scanned, imported = time.time(), 0, 0
+    for batch in _batches(rows.iterator(), batch_size):
+        pipes, copied = {}, []
+        for session_key, session_data, expire_date in batch:
+            session, ttl = legacy.decode(session_data), _remaining(expire_date)
+            if not session or ttl <= 0:
+                continue
+            copied.append(session_key)
+            if dry_run:
+                continue
+            server = RedisServer(session_key)
+            pipe = pipes.get(server.connection_key)
+            if pipe is None:
+                # no transaction: the batch is not atomic, every write is.
+                pipe = pipes[server.connection_key] = server.get().pipeline(transaction=False)
+            store_class(session_key)._import(pipe, session, ttl)
+        for pipe in pipes.values():
+            pipe.execute()
+        if delete and copied and not dry_run:
+            model.objects.filter(session_key__in=copied).delete()
+
+        scanned += len(batch)
+        imported += len(copied)
+        if report is not None:
+            report(scanned, imported)
+        _throttle(started, scanned, rate)
+    return imported
+
+
+def _scan(client, pattern, batch_size):
+    """Yields the keys matching ``pattern`` in lists of ``batch_size``."""
+    return _batches(client.scan_iter(match=pattern, count=batch_size), batch_size)
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _throttle(started, examined, rate):
+    if rate:
+        # stay under `rate` keys per second.
+        delay = started + float(examined) / rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _sessions(client, keys):
+    """
+    Returns the keys of the batch holding sessions, leaving out e.g. user
+    index sets and near-cache versions, which expire with their session.
+    """
+    keys = [key for key in keys if not key.endswith(VERSION_SUFFIX)]
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.type(key)
+    return [key for key, key_type in zip(keys, pipe.execute()) if key_type in SESSION_TYPES]
+
+
+def _select(store, client, keys, no_ttl, undecodable, predicate):
+    """Returns the keys of the batch that should be deleted."""
+    keys = [key for key in keys if not key.endswith(VERSION_SUFFIX)]
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.ttl(key)
+        pipe.type(key)
+    replies = pipe.execute()
+    ttls, types = replies[::2], replies[1::2]
+
+    doomed = []
+    candidates = []
+    for key, ttl, key_type in zip(keys, ttls, types):
+        if key_type not in SESSION_TYPES:
+            # not a session, e.g. a user index set.
+            continue
+        if no_ttl and ttl == -1:
+            doomed.append(key)
+        else:
+            candidates.append((key, key_type))
+    if not candidates or not (undecodable or predicate):
+        return doomed
+
+    pipe = client.pipeline(transaction=False)
+    for key, key_type in candidates:
+        if key_type == b'hash':
+            pipe.hgetall(key)
+        else:
+            pipe.get(key)
+    for (key, _), stored in zip(candidates, pipe.execute()):
+        if not stored:
+            # expired in the meantime.
+            continue
+        session = _decode(store, stored)
+        if session is None:
+            if undecodable:
+                doomed.append(key)
+        elif predicate is not None and predicate(store.get_session_key(key.decode()), session):
+            doomed.append(key)
+    return doomed
+
+
+def _decode(store, stored):
+    """Returns the session of a stored value, or None if it cannot be decoded."""
+    if isinstance(stored, dict):
+        session, fields = store._decode_fields(stored)
+        return session if fields is not None else None
+    session, serialized = store._decode(stored)
+    return session if serialized is not None else None
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from redis_sessions import settings
+from redis_sessions.maintenance import import_legacy
+from redis_sessions.session import SessionStore
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies the unexpired sessions of SESSION_REDIS['migrate_from'] (a "
+        "database session engine) to Redis, keeping their expiry."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--delete', action='store_true',
+            help="Delete the copied sessions from the database.",
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true', dest='dry_run',
+            help="Only report how many sessions would be copied.",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500, dest='batch_size',
+            help="Number of sessions read and written per batch (default: 500).",
+        )
+        parser.add_argument(
+            '--rate', type=float, default=None,
+            help="Maximum number of sessions read per second.",
+        )
+
+    def handle(self, **options):
+        if settings.SESSION_REDIS_MIGRATE_FROM is None:
+            raise CommandError("Set SESSION_REDIS['migrate_from'] to the session engine to import from.")
+
+        def report(scanned, imported):
+            if options['verbosity'] > 1:
+                self.stdout.write("%d sessions read, %d copied" % (scanned, imported))
+
+        try:
+            imported = import_legacy(
+                SessionStore,
+                delete=options['delete'],
+                dry_run=options['dry_run'],
+                batch_size=options['batch_size'],
+                rate=options['rate'],
+                report=report,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['dry_run']:
+            self.stdout.write("%d sessions would be copied." % imported)
+        else:
+            self.stdout.write("%d sessions copied." % imported)
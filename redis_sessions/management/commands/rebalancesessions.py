@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from redis_sessions import settings
+from redis_sessions.maintenance import rebalance
+from redis_sessions.session import SessionStore
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves the session keys of the servers of SESSION_REDIS['previous_pool'] "
+        "to their server in the current pool, keeping their expiry."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true', dest='dry_run',
+            help="Only report how many keys would be moved.",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500, dest='batch_size',
+            help="Number of keys scanned and moved per batch (default: 500).",
+        )
+        parser.add_argument(
+            '--rate', type=float, default=None,
+            help="Maximum number of keys examined per second.",
+        )
+
+    def handle(self, **options):
+        if settings.SESSION_REDIS_PREVIOUS_POOL is None:
+            raise CommandError("Set SESSION_REDIS['previous_pool'] to the pool sessions are moved from.")
+
+        def report(connection_key, scanned, moved):
+            if options['verbosity'] > 1:
+                self.stdout.write("%s: %d keys scanned, %d moved" % (connection_key, scanned, moved))
+
+        try:
+            moved = rebalance(
+                SessionStore,
+                dry_run=options['dry_run'],
+                batch_size=options['batch_size'],
+                rate=options['rate'],
+                report=report,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['dry_run']:
+            self.stdout.write("%d session keys would be moved." % moved)
+        else:
+            self.stdout.write("%d session keys moved." % moved)
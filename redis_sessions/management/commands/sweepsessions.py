@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from redis_sessions import settings
+from redis_sessions.maintenance import sweep
+from redis_sessions.session import SessionStore
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes session keys without expiry, that cannot be decoded, or "
+        "matching a predicate, on every configured Redis server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--no-ttl', action='store_true', dest='no_ttl',
+            help="Delete session keys that have no expiry.",
+        )
+        parser.add_argument(
+            '--undecodable', action='store_true',
+            help="Delete session keys whose value cannot be decoded.",
+        )
+        parser.add_argument(
+            '--predicate',
+            help="Dotted path to a callable(session_key, session) returning True for sessions to delete.",
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true', dest='dry_run',
+            help="Only report what would be deleted.",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500, dest='batch_size',
+            help="Number of keys scanned and deleted per batch (default: 500).",
+        )
+        parser.add_argument(
+            '--rate', type=float, default=None,
+            help="Maximum number of keys examined per second, 0 for no limit (default: the sweep_rate setting).",
+        )
+
+    def handle(self, **options):
+        predicate = options['predicate']
+        if predicate is not None:
+            predicate = import_string(predicate)
+        if not (options['no_ttl'] or options['undecodable'] or predicate):
+            raise CommandError("Give at least one of --no-ttl, --undecodable or --predicate.")
+
+        def report(connection_key, scanned, matched):
+            if options['verbosity'] > 1:
+                self.stdout.write("%s: %d keys scanned, %d matched" % (connection_key, scanned, matched))
+
+        try:
+            matched = sweep(
+                SessionStore,
+                no_ttl=options['no_ttl'],
+                undecodable=options['undecodable'],
+                predicate=predicate,
+                dry_run=options['dry_run'],
+                batch_size=options['batch_size'],
+                rate=settings.SESSION_REDIS_SWEEP_RATE if options['rate'] is None else options['rate'],
+                report=report,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['dry_run']:
+            self.stdout.write("%d session keys would be deleted." % matched)
+        else:
+            self.stdout.write("%d session keys deleted." % matched)
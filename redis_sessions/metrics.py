@@ -0,0 +1,200 @@
+"""
+Instrumentation of the session store.
+
+Operations report to the sink named by ``SESSION_REDIS['metrics']``:
+
+- ``redis_sessions_operation_seconds``: latency of load, save, exists,
+  delete and create, by ``operation`` and ``connection_key``;
+- ``redis_sessions_payload_bytes``: size of the stored values read by load
+  and written by save;
+- ``redis_sessions_load_total``: loads by ``result``, one of ``hit``,
+  ``miss``, ``migrated``, ``decode_error``, ``connection_error`` and
+  ``circuit_open``;
+- ``redis_sessions_create_retries_total``: session key collisions on create;
+- ``redis_sessions_errors_total``: operations that raised, by ``error``.
+
+The default sink does nothing and costs next to nothing.
+"""
+from collections import defaultdict
+import bisect
+import threading
+import time
+
+from django.utils.module_loading import import_string
+
+from redis_sessions import settings
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class BaseSink(object):
+    enabled = True
+
+    def increment(self, name, labels, value=1):
+        raise NotImplementedError
+
+    def observe(self, name, value, labels):
+        raise NotImplementedError
+
+
+class NullSink(BaseSink):
+    enabled = False
+
+    def increment(self, name, labels, value=1):
+        pass
+
+    def observe(self, name, value, labels):
+        pass
+
+
+class PrometheusSink(BaseSink):
+    """
+    Aggregates the metrics in the process, ``render()`` returns them in the
+    Prometheus text format (see ``metrics_view``).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {}
+
+    def increment(self, name, labels, value=1):
+        with self._lock:
+            self._counters[(name, _label_items(labels))] += value
+
+    def observe(self, name, value, labels):
+        buckets = LATENCY_BUCKETS if name.endswith('_seconds') else SIZE_BUCKETS
+        key = (name, _label_items(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # per-bucket counts (the last one is +Inf), sum.
+                histogram = self._histograms[key] = [buckets, [0] * (len(buckets) + 1), 0.0]
+            histogram[1][bisect.bisect_left(buckets, value)] += 1
+            histogram[2] += value
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE %s counter' % name)
+            lines.append('%s%s %s' % (name, _format_labels(labels), _format_value(value)))
+        for (name, labels), (buckets, counts, total) in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE %s histogram' % name)
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], counts):
+                cumulative += count
+                bucket_labels = labels + (('le', str(bound)),)
+                lines.append('%s_bucket%s %d' % (name, _format_labels(bucket_labels), cumulative))
+            lines.append('%s_sum%s %s' % (name, _format_labels(labels), _format_value(total)))
+            lines.append('%s_count%s %d' % (name, _format_labels(labels), cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+def _label_items(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels
+    )
+
+
+def _format_value(value):
+    return repr(float(value))
+
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def get_sink():
+    global _sink
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                path = settings.SESSION_REDIS_METRICS
+                _sink = import_string(path)() if path else NullSink()
+    return _sink
+
+
+class _Timer(object):
+    def __init__(self, sink, operation, store):
+        self.sink = sink
+        self.labels = {'operation': operation, 'connection_key': store.connection_key}
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.sink.observe('redis_sessions_operation_seconds', time.perf_counter() - self.started, self.labels)
+        if exc_type is not None:
+            labels = dict(self.labels, error=exc_type.__name__)
+            self.sink.increment('redis_sessions_errors_total', labels)
+        return False
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+def timed(operation, store):
+    """Context manager measuring an operation of ``store``."""
+    sink = get_sink()
+    if not sink.enabled:
+        return _null_timer
+    return _Timer(sink, operation, store)
+
+
+def record_load(store, result, size=None):
+    sink = get_sink()
+    if sink.enabled:
+        labels = {'connection_key': store.connection_key}
+        sink.increment('redis_sessions_load_total', dict(labels, result=result))
+        if size is not None:
+            sink.observe('redis_sessions_payload_bytes', size, dict(labels, operation='load'))
+
+
+def record_save(store, size):
+    sink = get_sink()
+    if sink.enabled:
+        labels = {'operation': 'save', 'connection_key': store.connection_key}
+        sink.observe('redis_sessions_payload_bytes', size, labels)
+
+
+def record_create_retry(store):
+    sink = get_sink()
+    if sink.enabled:
+        sink.increment('redis_sessions_create_retries_total', {'connection_key': store.connection_key})
+
+
+def metrics_view(request):
+    """
+    Serves the metrics of a PrometheusSink, to be routed in a urlconf. Other
+    sinks have nothing to render, the view is a 404 then.
+    """
+    from django.http import Http404, HttpResponse
+    render = getattr(get_sink(), 'render', None)
+    if render is None:
+        raise Http404("the metrics sink does not render metrics.")
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4')
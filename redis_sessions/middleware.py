@@ -0,0 +1,39 @@
+"""
+Session middleware extending the read-your-writes window of
+``read_from_replicas`` from the process that wrote a session to all of them.
+"""
+import math
+
+from django.conf import settings as django_settings
+from django.contrib.sessions.middleware import SessionMiddleware as BaseSessionMiddleware
+
+from redis_sessions import settings
+
+
+class SessionMiddleware(BaseSessionMiddleware):
+    """
+    Replaces ``django.contrib.sessions.middleware.SessionMiddleware``. After
+    a request saving or deleting its session, it sets a cookie that lives
+    ``read_your_writes`` seconds; while the browser sends it back, every
+    worker reads that session from the master. The cookie only routes reads,
+    a forged one costs a master read.
+    """
+    def process_request(self, request):
+        super(SessionMiddleware, self).process_request(request)
+        if settings.SESSION_REDIS_READ_YOUR_WRITES_COOKIE in request.COOKIES:
+            request.session.written_recently = True
+
+    def process_response(self, request, response):
+        response = super(SessionMiddleware, self).process_response(request, response)
+        session = getattr(request, 'session', None)
+        if settings.SESSION_REDIS_READ_FROM_REPLICAS and getattr(session, 'written', False):
+            response.set_cookie(
+                settings.SESSION_REDIS_READ_YOUR_WRITES_COOKIE, '1',
+                max_age=int(math.ceil(settings.SESSION_REDIS_READ_YOUR_WRITES)),
+                path=django_settings.SESSION_COOKIE_PATH,
+                domain=django_settings.SESSION_COOKIE_DOMAIN,
+                secure=django_settings.SESSION_COOKIE_SECURE or None,
+                httponly=True,
+                samesite=django_settings.SESSION_COOKIE_SAMESITE,
+            )
+        return response
@@ -0,0 +1,91 @@
+"""
+Per-process cache of stored session values, in front of Redis GETs.
+
+Entries are keyed by the real stored key and hold the version, the stored
+value and its verified serialized payload, so a hit is only deserialized.
+Saves and deletes made by this process update the cache directly. With
+``verify`` (the default) a hit is checked against the version stamped by
+every save, in one round trip replying a few bytes, so changes made by
+other processes are seen at once; without it they become visible once the
+entry's ``ttl`` runs out, so keep it short (around a second is enough to
+absorb bursts of requests from one browser).
+"""
+from collections import OrderedDict
+import threading
+import time
+
+from redis_sessions import settings
+
+
+class NearCache(object):
+    def __init__(self, max_size=1000, ttl=1.0, verify=True):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.verify = verify
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            # move to the most recently used end.
+            del self._entries[key]
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.time() + self.ttl)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_near_cache = None
+_recent_writes = None
+_near_cache_lock = threading.Lock()
+
+
+def get_near_cache():
+    """Returns the process wide near-cache, or None if it is disabled."""
+    global _near_cache
+    if settings.SESSION_REDIS_NEAR_CACHE is None:
+        return None
+    if _near_cache is None:
+        with _near_cache_lock:
+            if _near_cache is None:
+                _near_cache = NearCache(**settings.SESSION_REDIS_NEAR_CACHE)
+    return _near_cache
+
+
+def get_recent_writes():
+    """
+    Returns the keys this process wrote in the last ``read_your_writes``
+    seconds, at most ``read_your_writes_max_size`` of them, or None if
+    sessions are not read from replicas.
+    """
+    global _recent_writes
+    if not settings.SESSION_REDIS_READ_FROM_REPLICAS:
+        return None
+    if _recent_writes is None:
+        with _near_cache_lock:
+            if _recent_writes is None:
+                _recent_writes = NearCache(
+                    max_size=settings.SESSION_REDIS_READ_YOUR_WRITES_MAX_SIZE,
+                    ttl=settings.SESSION_REDIS_READ_YOUR_WRITES,
+                )
+    return _recent_writes
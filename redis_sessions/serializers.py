@@ -0,0 +1,159 @@
+"""
+Compact session serializers, for ``SESSION_SERIALIZER``.
+
+``MsgpackSerializer`` requires ``msgpack`` and ``OrjsonSerializer`` requires
+``orjson`` (``pip install django-redis-sessions[msgpack]`` or ``[orjson]``).
+Unlike Django's JSONSerializer, both keep datetimes, dates, times and
+Decimals as such, tagged in the payload. Tuples come back as lists.
+
+Values that cannot be read (written by the previous ``SESSION_SERIALIZER``)
+are passed to ``SESSION_REDIS['serializer_fallback']``, Django's
+JSONSerializer by default, so existing sessions survive the switch and are
+rewritten with the new serializer on their next save.
+"""
+from decimal import Decimal
+import datetime
+import re
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.dateparse import parse_date, parse_datetime, parse_time
+from django.utils.module_loading import import_string
+
+from redis_sessions import settings
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# msgpack payloads start with a byte msgpack never uses, so that they are
+# told apart from the payloads of other serializers: a JSON number like
+# b'5' is a valid msgpack document too.
+MSGPACK_MARKER = b'\xc1'
+
+# msgpack extension types of the tagged values.
+EXT_DATETIME = 1
+EXT_DATE = 2
+EXT_TIME = 3
+EXT_DECIMAL = 4
+
+_PARSERS = {
+    EXT_DATETIME: parse_datetime,
+    EXT_DATE: parse_date,
+    EXT_TIME: parse_time,
+    EXT_DECIMAL: Decimal,
+}
+
+
+def _tag(obj):
+    """Returns the extension type and text of a value serializers do not support natively."""
+    # datetime is a subclass of date.
+    if isinstance(obj, datetime.datetime):
+        return EXT_DATETIME, obj.isoformat()
+    if isinstance(obj, datetime.date):
+        return EXT_DATE, obj.isoformat()
+    if isinstance(obj, datetime.time):
+        return EXT_TIME, obj.isoformat()
+    if isinstance(obj, Decimal):
+        return EXT_DECIMAL, str(obj)
+    raise TypeError("%r is not serializable in a session." % (obj,))
+
+
+class FallbackMixin(object):
+    """Passes the payloads the serializer cannot read to ``serializer_fallback``."""
+
+    def fallback_loads(self, data, error):
+        path = settings.SESSION_REDIS_SERIALIZER_FALLBACK
+        if path is None:
+            raise error
+        return import_string(path)().loads(bytes(data))
+
+
+class MsgpackSerializer(FallbackMixin):
+    # loads() takes any bytes-like object, the session store passes it a
+    # memoryview of the stored value.
+    accepts_buffer = True
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImproperlyConfigured("MsgpackSerializer requires the msgpack package.")
+
+    def dumps(self, obj):
+        return MSGPACK_MARKER + msgpack.packb(obj, default=self._default, use_bin_type=True)
+
+    def loads(self, data):
+        if bytes(data[:1]) != MSGPACK_MARKER:
+            return self.fallback_loads(data, ValueError("not a msgpack session payload."))
+        return msgpack.unpackb(data[1:], ext_hook=self._ext_hook, raw=False, strict_map_key=False)
+
+    @staticmethod
+    def _default(obj):
+        code, text = _tag(obj)
+        return msgpack.ExtType(code, text.encode())
+
+    @staticmethod
+    def _ext_hook(code, data):
+        parse = _PARSERS.get(code)
+        if parse is None:
+            return msgpack.ExtType(code, data)
+        return parse(data.decode())
+
+
+# keys of the objects standing for tagged values in JSON.
+JSON_TAGS = {
+    EXT_DATETIME: '__datetime__',
+    EXT_DATE: '__date__',
+    EXT_TIME: '__time__',
+    EXT_DECIMAL: '__decimal__',
+}
+_JSON_TAG = re.compile(b'"__')
+_JSON_PARSERS = dict((JSON_TAGS[code], parse) for code, parse in _PARSERS.items())
+
+
+class OrjsonSerializer(FallbackMixin):
+    """
+    JSON serializer, compatible with the payloads of Django's JSONSerializer
+    in both directions except for the tagged values.
+    """
+    accepts_buffer = True
+
+    def __init__(self):
+        if orjson is None:
+            raise ImproperlyConfigured("OrjsonSerializer requires the orjson package.")
+        self.options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj):
+        return orjson.dumps(obj, default=self._default, option=self.options)
+
+    def loads(self, data):
+        try:
+            obj = orjson.loads(data)
+        except orjson.JSONDecodeError as e:
+            return self.fallback_loads(data, e)
+        if _JSON_TAG.search(data) is None:
+            # nothing tagged, skip the walk.
+            return obj
+        return self._revive(obj)
+
+    @staticmethod
+    def _default(obj):
+        code, text = _tag(obj)
+        return {JSON_TAGS[code]: text}
+
+    @classmethod
+    def _revive(cls, obj):
+        if isinstance(obj, dict):
+            if len(obj) == 1:
+                tag, text = next(iter(obj.items()))
+                parse = _JSON_PARSERS.get(tag)
+                if parse is not None and isinstance(text, str):
+                    return parse(text)
+            return dict((key, cls._revive(value)) for key, value in obj.items())
+        if isinstance(obj, list):
+            return [cls._revive(value) for value in obj]
+        return obj
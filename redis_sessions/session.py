@@ -3,108 +3,773 @@ import redis
 try:
     from django.utils.encoding import force_unicode
 except ImportError:  # Python 3.*
-    from django.utils.encoding import force_text as force_unicode
-from django.contrib.sessions.backends.base import SessionBase, CreateError
+    try:
+        from django.utils.encoding import force_text as force_unicode
+    except ImportError:  # Django >= 4.0
+        from django.utils.encoding import force_str as force_unicode
+from django.conf import settings as django_settings
+from django.contrib.sessions.backends.base import SessionBase, CreateError, UpdateError
+from django.contrib.sessions.exceptions import SuspiciousSession
+from django.core.exceptions import SuspiciousOperation
+from django.utils.crypto import salted_hmac
+from django.utils import timezone
+from django.utils.encoding import force_bytes
 from redis_sessions import settings
+from redis_sessions.breaker import CircuitBreaker, CircuitOpenError, null_breaker
+from redis_sessions.compressors import get_compressor, get_decompressor
+from redis_sessions.metrics import record_create_retry, record_load, record_save, timed
+from redis_sessions.near_cache import get_near_cache, get_recent_writes
+from redis_sessions.write_behind import get_write_behind
+from collections import namedtuple
+from importlib import import_module
 import base64
+import bisect
+import hashlib
+import hmac
+import logging
+import os
+import random
+import struct
+import threading
+import time
+import weakref
+
+
+logger = logging.getLogger('redis_sessions')
+
+# Sessions stored in the binary format start with a marker byte followed by
+# the format version and the payload codec. The marker is not part of the
+# base64 alphabet, so base64 and binary values can share one keyspace.
+BINARY_MARKER = b'\x00'
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct('!cBB')
+CODEC_NONE = 0
+
+# Sessions kept in the hash storage always have this field, so that empty
+# sessions exist too. It holds their version.
+HASH_MARKER = b'\x00'
+
+# KEYS: session key, and the user index key when the session is indexed.
+# ARGV: mode, expiry, session key and expiry for the user index, number of
+# fields to delete, the fields to delete, then field/value pairs to set.
+# 'create' fails if the key exists, 'update' fails if it does not, 'replace'
+# overwrites whatever is stored.
+HASH_SAVE_SCRIPT = """
+local exists = redis.call('exists', KEYS[1])
+if (ARGV[1] == 'create' and exists == 1) or (ARGV[1] == 'update' and exists == 0) then
+    return 0
+end
+if ARGV[1] == 'replace' then
+    redis.call('del', KEYS[1])
+end
+local removed = tonumber(ARGV[5])
+for i = 6, removed + 5 do
+    redis.call('hdel', KEYS[1], ARGV[i])
+end
+for i = removed + 6, #ARGV, 2 do
+    redis.call('hset', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('expire', KEYS[1], ARGV[2])
+if KEYS[2] then
+    redis.call('sadd', KEYS[2], ARGV[3])
+    redis.call('expire', KEYS[2], ARGV[4])
+end
+return 1
+"""
+
+# KEYS: session key, and the user index key when the session is indexed.
+# ARGV: SHA1 of the value the session was loaded from ('' if none, '*' to
+# write anyway), value, expiry, session key and expiry for the user index.
+# The value is written if the stored one is still the loaded one, otherwise
+# the stored one is returned (nil if it was deleted).
+VERSIONED_SAVE_SCRIPT = """
+local current = redis.call('get', KEYS[1])
+if ARGV[1] ~= '*' and (current and redis.sha1hex(current) or '') ~= ARGV[1] then
+    return {0, current}
+end
+redis.call('setex', KEYS[1], ARGV[3], ARGV[2])
+if KEYS[2] then
+    redis.call('sadd', KEYS[2], ARGV[4])
+    redis.call('expire', KEYS[2], ARGV[5])
+end
+return {1}
+"""
+
+# the key holding the version of a string session, after its own key. Saves
+# write a new random version there (and in the HASH_MARKER field of a hash
+# session), so that near-cache hits only read the version.
+VERSION_KEY_SUFFIX = ':version'
+
+# KEYS: user index key. ARGV: what comes before and after session keys in
+# their redis keys. Returns the session keys deleted, which leave the index,
+# and the ones not found, which stay in it.
+DELETE_USER_SESSIONS_SCRIPT = """
+local deleted, missing = {}, {}
+for _, session_key in ipairs(redis.call('smembers', KEYS[1])) do
+    if redis.call('del', ARGV[1] .. session_key .. ARGV[2]) == 1 then
+        redis.call('srem', KEYS[1], session_key)
+        deleted[#deleted + 1] = session_key
+    else
+        missing[#missing + 1] = session_key
+    end
+end
+return {deleted, missing}
+"""
+
+# the session key django.contrib.auth stores the user id under.
+USER_ID_SESSION_KEY = '_auth_user_id'
+
+_scripts = {}
+_hmac_keys = {}
+_missing = object()
+# ids of the clients of servers without GETEX (Redis < 6.2).
+_no_getex = set()
+
+
+def _script(client, source):
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = client.register_script(source)
+    return script
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _get_connection(pool):
+    try:
+        return pool.get_connection()
+    except TypeError:
+        # redis-py < 5.3 requires a command name.
+        return pool.get_connection('PING')
+
+
+def _unlink(client, keys):
+    """Deletes keys with UNLINK, which frees memory in the background (Redis >= 4.0)."""
+    if settings.SESSION_REDIS_CLUSTER is not None:
+        # a cluster refuses multi-key commands over several slots.
+        pipe = client.pipeline(transaction=False)
+        for key in keys:
+            pipe.unlink(key)
+        return sum(pipe.execute())
+    try:
+        return client.unlink(*keys)
+    except redis.ResponseError:
+        return client.delete(*keys)
+
+
+def _new_version():
+    return os.urandom(8)
+
+
+def _remaining(expire_date):
+    """Returns the seconds left until ``expire_date``."""
+    return int((expire_date - timezone.now()).total_seconds())
+
+
+def _read_legacy(legacy):
+    """
+    Returns the session of a ``migrate_from`` store and its remaining
+    lifetime in seconds: the one of its row for the database engines, the
+    configured one otherwise.
+    """
+    get_row = getattr(legacy, '_get_session_from_db', None)
+    if get_row is None:
+        return legacy.load(), legacy.get_expiry_age()
+    row = get_row()
+    if row is None:
+        return {}, 0
+    return legacy.decode(row.session_data), _remaining(row.expire_date)
+
+
+def _restore_pipeline(source, target, keys):
+    """
+    Dumps ``keys`` from ``source`` with their remaining TTL, and returns the
+    ``target`` pipeline restoring them along with the keys found.
+    """
+    pipe = source.pipeline(transaction=False)
+    for key in keys:
+        pipe.dump(key)
+        pipe.pttl(key)
+    replies = pipe.execute()
+
+    pipe = target.pipeline(transaction=False)
+    found = []
+    for key, dumped, pttl in zip(keys, replies[::2], replies[1::2]):
+        if dumped is None or pttl == -2:
+            # expired in the meantime.
+            continue
+        # RESTORE takes 0 for no expiry.
+        pipe.restore(key, max(pttl, 0), dumped)
+        found.append(key)
+    return pipe, found
+
+
+def _check_restored(results):
+    for result in results:
+        # BUSYKEY: written on the target since the pool changed, it is kept.
+        if isinstance(result, redis.ResponseError) and not str(result).startswith('BUSYKEY'):
+            raise result
+
+
+def _move(store, source, target, keys):
+    """
+    Moves ``keys`` from ``source`` to ``target`` with DUMP/RESTORE, keeping
+    their remaining TTL, and returns the number of keys moved.
+    """
+    pipe, found = _restore_pipeline(source, target, keys)
+    if found:
+        _check_restored(pipe.execute(raise_on_error=False))
+        if settings.SESSION_REDIS_USER_INDEX:
+            _move_index(store, source, target, found)
+        _unlink(source, found)
+    return len(found)
+
+
+def _move_index(store, source, target, keys):
+    """
+    Moves the user index entries of the sessions ``keys`` moved from
+    ``source`` to ``target``, or ``delete_user_sessions`` would miss them
+    once ``previous_pool`` is removed.
+    """
+    add = target.pipeline(transaction=False)
+    remove = source.pipeline(transaction=False)
+    for key, stored in zip(keys, _read_many(source, keys)):
+        index = store._moved_index(stored)
+        if index is None:
+            continue
+        index_key, age = index
+        session_key = store.get_session_key(key.decode() if isinstance(key, bytes) else key)
+        add.sadd(index_key, session_key).expire(index_key, age)
+        remove.srem(index_key, session_key)
+    add.execute()
+    remove.execute()
+
+
+def _read_many(client, keys):
+    """
+    Returns the stored values of ``keys``: bytes, or a dict of fields for
+    the hash storage.
+    """
+    hash_storage = settings.SESSION_REDIS_STORAGE == 'hash'
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        if hash_storage:
+            pipe.hgetall(key)
+        else:
+            pipe.get(key)
+    values = pipe.execute(raise_on_error=False)
+    # sessions written by the other storage, not replaced yet.
+    others = [i for i, value in enumerate(values) if isinstance(value, redis.ResponseError)]
+    if others:
+        pipe = client.pipeline(transaction=False)
+        for i in others:
+            if hash_storage:
+                pipe.get(keys[i])
+            else:
+                pipe.hgetall(keys[i])
+        for i, value in zip(others, pipe.execute(raise_on_error=False)):
+            values[i] = None if isinstance(value, redis.ResponseError) else value
+    return values
+
+
+class HashRing(object):
+    """
+    Weighted consistent hash ring over a servers pool.
+
+    Each server gets ``weight * replicas`` virtual nodes, placed by hashing
+    its name, so adding or removing a server only moves the keys of its own
+    nodes. A server is named by its ``name`` entry, or else by its address.
+    """
+    def __init__(self, servers_pool, replicas=40):
+        points = []
+        for server_key, server in enumerate(servers_pool):
+            name = self.server_name(server)
+            for i in range(server.get('weight', 1) * replicas):
+                digest = hashlib.md5(('%s-%d' % (name, i)).encode()).digest()
+                # four points per digest, as ketama does.
+                for point in struct.unpack('<4I', digest):
+                    points.append((point, server_key))
+        points.sort()
+        self._points = [point for point, _ in points]
+        self._server_keys = [server_key for _, server_key in points]
+
+    @staticmethod
+    def server_name(server):
+        if server.get('name'):
+            return server['name']
+        if server.get('url'):
+            return server['url']
+        if server.get('unix_domain_socket_path'):
+            return '%s/%s' % (server['unix_domain_socket_path'], server.get('db', 0))
+        return '%s:%s/%s' % (server.get('host', 'localhost'), server.get('port', 6379), server.get('db', 0))
+
+    def get_server_key(self, key):
+        point = struct.unpack_from('<I', hashlib.md5(key.encode()).digest())[0]
+        return self._server_keys[bisect.bisect(self._points, point) % len(self._points)]
+
+
+class WeightedModulo(object):
+    """
+    The original pool router: the first four characters of the key, modulo
+    the total weight of the pool.
+    """
+    def __init__(self, servers_pool):
+        self._bounds = []
+        total_weight = 0
+        for server in servers_pool:
+            total_weight += server.get('weight', 1)
+            self._bounds.append(total_weight)
+
+    def get_server_key(self, key):
+        pos = 0
+        for i in range(3, -1, -1):
+            pos = pos * 2 ** 8 + ord(key[i])
+        return bisect.bisect(self._bounds, pos % self._bounds[-1])
+
+
+# connection pool options of SESSION_REDIS, which pool entries can override.
+POOL_OPTIONS = (
+    'max_connections',
+    'socket_connect_timeout',
+    'socket_keepalive',
+    'socket_keepalive_options',
+    'health_check_interval',
+)
+
+# A resolved connection: ``options`` holds the address of the server.
+ServerConfig = namedtuple('ServerConfig', ['connection_key', 'connection_type', 'options'])
+
+
+def _address(config):
+    """Returns what tells the server (and database) of a config apart."""
+    options = config.options
+    return tuple(options.get(name) for name in ('url', 'unix_domain_socket_path', 'host', 'port', 'db'))
 
 
 class RedisServer:
+    """
+    Resolves the redis client of a session key.
+
+    The server configs and the pool router are built once from the settings
+    and shared by all threads, as are the clients; resolving a session key
+    is a router lookup and a dict lookup.
+    """
     __redis = {}
+    # async clients are bound to the event loop they were created in.
+    __async_redis = weakref.WeakKeyDictionary()
+    __breakers = {}
+    __routers = {}
+    __routing = None
+    __previous_routing = None
+    # reentrant: the previous routing is built on the current one.
+    __lock = threading.RLock()
 
     def __init__(self, session_key):
         self.session_key = session_key
-        self.connection_key = ''
+        servers, router = self.get_routing()
+        if router is None or not session_key:
+            # new sessions are routed again once they get a key.
+            self.config = servers[0]
+        else:
+            self.config = servers[router.get_server_key(session_key)]
+        self.connection_key = self.config.connection_key
+        self.connection_type = self.config.connection_type
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, RedisServer) and
+            (self.session_key, self.connection_key) == (other.session_key, other.connection_key)
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    @classmethod
+    def get_routing(cls):
+        """Returns the server configs, and the router for pools."""
+        if cls.__routing is None:
+            with cls.__lock:
+                if cls.__routing is None:
+                    cls.__routing = cls.build_routing()
+        return cls.__routing
+
+    @classmethod
+    def build_routing(cls):
+        if settings.SESSION_REDIS_CLUSTER is not None:
+            # the cluster client routes keys to their slot by itself.
+            options = dict(
+                (name, getattr(settings, 'SESSION_REDIS_' + name.upper())) for name in POOL_OPTIONS
+            )
+            options.update(startup_nodes=settings.SESSION_REDIS_CLUSTER, password=settings.SESSION_REDIS_PASSWORD)
+            options['replicas'] = (ServerConfig('cluster:replica', 'cluster', dict(options, read_from_replicas=True)),)
+            return (ServerConfig('cluster', 'cluster', options),), None
 
         if settings.SESSION_REDIS_SENTINEL_LIST is not None:
-            self.connection_type = 'sentinel'
+            options = dict(
+                (name, getattr(settings, 'SESSION_REDIS_' + name.upper())) for name in POOL_OPTIONS
+            )
+            options.update(db=settings.SESSION_REDIS_DB, password=settings.SESSION_REDIS_PASSWORD)
+            options['replicas'] = (ServerConfig('sentinel:replica', 'sentinel', dict(options, replica=True)),)
+            config = ServerConfig('sentinel', 'sentinel', options)
+            return (config,), None
+
+        if settings.SESSION_REDIS_POOL is None:
+            config = cls.server_config('', {
+                'host': settings.SESSION_REDIS_HOST,
+                'port': settings.SESSION_REDIS_PORT,
+                'db': settings.SESSION_REDIS_DB,
+                'password': settings.SESSION_REDIS_PASSWORD,
+                'url': settings.SESSION_REDIS_URL,
+                'unix_domain_socket_path': settings.SESSION_REDIS_UNIX_DOMAIN_SOCKET_PATH,
+                'replicas': settings.SESSION_REDIS_REPLICAS,
+            })
+            return (config,), None
+
+        servers = tuple(
+            cls.server_config(str(server_key), server)
+            for server_key, server in enumerate(settings.SESSION_REDIS_POOL)
+        )
+        return servers, cls.get_router(settings.SESSION_REDIS_POOL)
+
+    @classmethod
+    def get_previous_routing(cls):
+        """Returns the server configs and the router of ``previous_pool``."""
+        if cls.__previous_routing is None:
+            with cls.__lock:
+                if cls.__previous_routing is None:
+                    cls.__previous_routing = cls.build_previous_routing()
+        return cls.__previous_routing
+
+    @classmethod
+    def build_previous_routing(cls):
+        previous_pool = settings.SESSION_REDIS_PREVIOUS_POOL
+        if previous_pool is None:
+            return (), None
+        # servers still in use keep their config, and so their clients.
+        current = dict((_address(config), config) for config in cls.get_routing()[0])
+        servers = []
+        for server_key, server in enumerate(previous_pool):
+            config = cls.server_config('previous%d' % server_key, server)
+            servers.append(current.get(_address(config), config))
+        return tuple(servers), cls.get_router(previous_pool, settings.SESSION_REDIS_PREVIOUS_POOL_ROUTER)
+
+    @classmethod
+    def server_config(cls, connection_key, server):
+        options = {
+            'host': server.get('host', 'localhost'),
+            'port': server.get('port', 6379),
+            'db': server.get('db', 0),
+            'password': server.get('password', None),
+            'url': server.get('url', None),
+            'unix_domain_socket_path': server.get('unix_domain_socket_path', None),
+        }
+        for name in POOL_OPTIONS + ('blocking_pool', 'blocking_pool_timeout'):
+            options[name] = server.get(name, getattr(settings, 'SESSION_REDIS_' + name.upper()))
+        if options['url'] is not None:
+            connection_type = 'redis_url'
+        elif options['unix_domain_socket_path'] is not None:
+            connection_type = 'redis_unix_url'
         else:
-            if settings.SESSION_REDIS_POOL is not None:
-                server_key, server = self.get_server(session_key, settings.SESSION_REDIS_POOL)
-                self.connection_key = str(server_key)
-                settings.SESSION_REDIS_HOST = getattr(server, 'host', 'localhost')
-                settings.SESSION_REDIS_PORT = getattr(server, 'port', 6379)
-                settings.SESSION_REDIS_DB = getattr(server, 'db', 0)
-                settings.SESSION_REDIS_PASSWORD = getattr(server, 'password', None)
-                settings.SESSION_REDIS_URL = getattr(server, 'url', None)
-                settings.SESSION_REDIS_UNIX_DOMAIN_SOCKET_PATH = getattr(server,'unix_domain_socket_path', None)
-
-            if settings.SESSION_REDIS_URL is not None:
-                self.connection_type = 'redis_url'
-            elif settings.SESSION_REDIS_HOST is not None:
-                self.connection_type = 'redis_host'
-            elif settings.SESSION_REDIS_UNIX_DOMAIN_SOCKET_PATH is not None:
-                self.connection_type = 'redis_unix_url'
-
-        self.connection_key += self.connection_type
+            connection_type = 'redis_host'
+        connection_key += connection_type
 
-    def get_server(self, key, servers_pool):
-        total_weight = sum([row.get('weight', 1) for row in servers_pool])
-        pos = 0
-        for i in range(3, -1, -1):
-            pos = pos * 2 ** 8 + ord(key[i])
-        pos = pos % total_weight
+        replicas = []
+        for i, replica in enumerate(server.get('replicas') or ()):
+            # replicas share the database and credentials of their master.
+            replica = dict(replica)
+            replica.setdefault('db', options['db'])
+            replica.setdefault('password', options['password'])
+            replicas.append(cls.server_config('%s/replica%d/' % (connection_key, i), replica))
+        options['replicas'] = tuple(replicas)
+        return ServerConfig(connection_key, connection_type, options)
+
+    @classmethod
+    def get_router(cls, servers_pool, kind=None):
+        # routers are built once per pool definition.
+        router = cls.__routers.get(id(servers_pool))
+        if router is None or router[0] is not servers_pool:
+            if (kind or settings.SESSION_REDIS_POOL_ROUTER) == 'ring':
+                router = (servers_pool, HashRing(servers_pool))
+            else:
+                router = (servers_pool, WeightedModulo(servers_pool))
+            cls.__routers[id(servers_pool)] = router
+        return router[1]
 
-        pool = iter(servers_pool)
-        server = next(pool)
-        server_key = 0
-        i = 0
-        while i < total_weight:
-            if i <= pos < (i + server.get('weight', 1)):
-                return server_key, server
-            i += server.get('weight', 1)
-            server = next(pool)
-            server_key += 1
+    @classmethod
+    def reset(cls):
+        """Forgets the resolved routing and clients, after changing the settings."""
+        with cls.__lock:
+            cls.__routing = None
+            cls.__previous_routing = None
+            cls.__routers.clear()
+            cls.__redis.clear()
+            cls.__async_redis.clear()
+            cls.__breakers.clear()
 
-        return
+    def get_server(self, key, servers_pool):
+        server_key = self.get_router(servers_pool).get_server_key(key)
+        return server_key, servers_pool[server_key]
 
     def get(self):
-        if self.connection_key in self.__redis:
-            return self.__redis[self.connection_key]
+        return self.client(self.config)
+
+    @classmethod
+    def client(cls, config):
+        client = cls.__redis.get(config.connection_key)
+        if client is None:
+            with cls.__lock:
+                client = cls.__redis.get(config.connection_key)
+                if client is None:
+                    client = cls.__redis[config.connection_key] = cls.connect(config)
+        return client
+
+    def guard(self):
+        """
+        Returns the circuit breaker of this server, to wrap its operations in,
+        or a no-op context manager when the breaker is disabled.
+        """
+        if not settings.SESSION_REDIS_BREAKER_THRESHOLD:
+            return null_breaker
+        breaker = self.__breakers.get(self.connection_key)
+        if breaker is None:
+            with self.__lock:
+                breaker = self.__breakers.get(self.connection_key)
+                if breaker is None:
+                    breaker = CircuitBreaker(
+                        settings.SESSION_REDIS_BREAKER_THRESHOLD,
+                        settings.SESSION_REDIS_BREAKER_COOLDOWN,
+                    )
+                    self.__breakers[self.connection_key] = breaker
+        return breaker
+
+    @classmethod
+    def get_all(cls):
+        """
+        Returns ``(connection_key, client)`` for every configured server, or
+        for every primary node of a cluster.
+        """
+        servers, _ = cls.get_routing()
+        if servers[0].connection_type == 'cluster':
+            cluster = cls.client(servers[0])
+            return [
+                ('cluster:%s' % node.name, cluster.get_redis_connection(node))
+                for node in cluster.get_primaries()
+            ]
+        return [(config.connection_key, cls.client(config)) for config in servers]
+
+    def get_async(self):
+        """Returns a ``redis.asyncio`` client for the same server."""
+        return self.async_client(self.config)
+
+    @classmethod
+    def async_client(cls, config):
+        """Returns the client of ``config`` for the running event loop."""
+        from asyncio import get_running_loop
+        loop = get_running_loop()
+        client = cls.__async_redis.get(loop, {}).get(config.connection_key)
+        if client is None:
+            with cls.__lock:
+                clients = cls.__async_redis.get(loop)
+                if clients is None:
+                    # the clients of closed loops keep them alive, drop them.
+                    for closed in [other for other in cls.__async_redis.keys() if other.is_closed()]:
+                        del cls.__async_redis[closed]
+                    clients = cls.__async_redis[loop] = {}
+                client = clients.get(config.connection_key)
+                if client is None:
+                    client = clients[config.connection_key] = cls.connect(config, asyncio=True)
+        return client
+
+    def previous_config(self):
+        """
+        Returns the config of the server owning this session key in
+        ``previous_pool``, or None when it is the current server.
+        """
+        servers, router = self.get_previous_routing()
+        if router is None or not self.session_key:
+            return None
+        config = servers[router.get_server_key(self.session_key)]
+        return None if config.connection_key == self.connection_key else config
+
+    def get_previous(self):
+        """Returns the client of the previous server of this session key, or None."""
+        config = self.previous_config()
+        return None if config is None else self.client(config)
+
+    def get_previous_async(self):
+        config = self.previous_config()
+        return None if config is None else self.async_client(config)
 
-        if self.connection_type == 'sentinel':
-            from redis.sentinel import Sentinel
-            self.__redis[self.connection_key] = Sentinel(
+    @classmethod
+    def get_all_previous(cls):
+        """Returns ``(connection_key, client)`` for every server of ``previous_pool``."""
+        servers, _ = cls.get_previous_routing()
+        return [(config.connection_key, cls.client(config)) for config in servers]
+
+    @classmethod
+    def get_all_retired(cls):
+        """
+        Returns ``(connection_key, client)`` for the servers of ``previous_pool``
+        that are not in the current pool.
+        """
+        current = set(config.connection_key for config in cls.get_routing()[0])
+        return [server for server in cls.get_all_previous() if server[0] not in current]
+
+    def replica_config(self):
+        """Returns the config of a replica to read from, or None to read from the master."""
+        replicas = self.config.options.get('replicas')
+        if not settings.SESSION_REDIS_READ_FROM_REPLICAS or not replicas:
+            return None
+        return random.choice(replicas)
+
+    def get_replica(self):
+        """Returns a client reading from a replica of this server, or from the server itself."""
+        config = self.replica_config()
+        return self.get() if config is None else self.client(config)
+
+    def get_replica_async(self):
+        config = self.replica_config()
+        return self.get_async() if config is None else self.async_client(config)
+
+    @staticmethod
+    def connect(config, asyncio=False):
+        if asyncio:
+            import redis.asyncio as client_module
+        else:
+            client_module = redis
+
+        options = config.options
+        pool_options = dict(
+            (name, options[name]) for name in POOL_OPTIONS
+            if options.get(name) is not None
+        )
+        if config.connection_type == 'sentinel':
+            if asyncio:
+                from redis.asyncio.sentinel import Sentinel
+            else:
+                from redis.sentinel import Sentinel
+            sentinel = Sentinel(
                 settings.SESSION_REDIS_SENTINEL_LIST,
                 socket_timeout=settings.SESSION_REDIS_SOCKET_TIMEOUT,
                 retry_on_timeout=settings.SESSION_REDIS_RETRY_ON_TIMEOUT,
-                db=getattr(settings, 'SESSION_REDIS_DB', 0),
-                password=getattr(settings, 'SESSION_REDIS_PASSWORD', None)
-            ).master_for(settings.SESSION_REDIS_SENTINEL_MASTER_ALIAS)
-
-        elif self.connection_type == 'redis_url':
-            self.__redis[self.connection_key] = redis.StrictRedis.from_url(
-                settings.SESSION_REDIS_URL,
-                socket_timeout=settings.SESSION_REDIS_SOCKET_TIMEOUT
+                db=options['db'],
+                password=options['password']
             )
-        elif self.connection_type == 'redis_host':
-            self.__redis[self.connection_key] = redis.StrictRedis(
-                host=settings.SESSION_REDIS_HOST,
-                port=settings.SESSION_REDIS_PORT,
+            if options.get('replica'):
+                # falls back to the master when no replica is up.
+                return sentinel.slave_for(settings.SESSION_REDIS_SENTINEL_MASTER_ALIAS, **pool_options)
+            return sentinel.master_for(settings.SESSION_REDIS_SENTINEL_MASTER_ALIAS, **pool_options)
+
+        if config.connection_type == 'cluster':
+            if asyncio:
+                from redis.asyncio.cluster import ClusterNode, RedisCluster
+            else:
+                from redis.cluster import ClusterNode, RedisCluster
+            return RedisCluster(
+                startup_nodes=[
+                    ClusterNode(node.get('host', 'localhost'), node.get('port', 6379))
+                    for node in options['startup_nodes']
+                ],
+                socket_timeout=settings.SESSION_REDIS_SOCKET_TIMEOUT,
+                password=options['password'],
+                read_from_replicas=options.get('read_from_replicas', False),
+                **pool_options
+            )
+
+        if options.get('blocking_pool'):
+            pool_class = client_module.BlockingConnectionPool
+            pool_options['timeout'] = options['blocking_pool_timeout']
+        else:
+            pool_class = client_module.ConnectionPool
+
+        if config.connection_type == 'redis_url':
+            pool = pool_class.from_url(
+                options['url'],
+                socket_timeout=settings.SESSION_REDIS_SOCKET_TIMEOUT,
+                **pool_options
+            )
+        elif config.connection_type == 'redis_host':
+            pool = pool_class(
+                host=options['host'],
+                port=options['port'],
                 socket_timeout=settings.SESSION_REDIS_SOCKET_TIMEOUT,
                 retry_on_timeout=settings.SESSION_REDIS_RETRY_ON_TIMEOUT,
-                db=settings.SESSION_REDIS_DB,
-                password=settings.SESSION_REDIS_PASSWORD
+                db=options['db'],
+                password=options['password'],
+                **pool_options
             )
-        elif self.connection_type == 'redis_unix_url':
-            self.__redis[self.connection_key] = redis.StrictRedis(
-                unix_socket_path=settings.SESSION_REDIS_UNIX_DOMAIN_SOCKET_PATH,
+        elif config.connection_type == 'redis_unix_url':
+            # keepalive only applies to TCP connections.
+            pool_options.pop('socket_keepalive', None)
+            pool_options.pop('socket_keepalive_options', None)
+            pool = pool_class(
+                connection_class=client_module.UnixDomainSocketConnection,
+                path=options['unix_domain_socket_path'],
                 socket_timeout=settings.SESSION_REDIS_SOCKET_TIMEOUT,
                 retry_on_timeout=settings.SESSION_REDIS_RETRY_ON_TIMEOUT,
-                db=settings.SESSION_REDIS_DB,
-                password=settings.SESSION_REDIS_PASSWORD,
+                db=options['db'],
+                password=options['password'],
+                **pool_options
             )
+        return client_module.StrictRedis(connection_pool=pool)
 
-        return self.__redis[self.connection_key]
+    @classmethod
+    def prewarm(cls, connections=1):
+        """
+        Opens ``connections`` connections to every configured server and
+        checks them with a PING, so that the first requests do not pay for
+        the connection setup. Returns the number of servers that failed.
+        """
+        failed = 0
+        for connection_key, client in cls.get_all():
+            pool = client.connection_pool
+            opened = []
+            try:
+                for i in range(connections):
+                    connection = _get_connection(pool)
+                    opened.append(connection)
+                    connection.send_command('PING')
+                    connection.read_response()
+            except redis.RedisError as e:
+                failed += 1
+                logger.warning("Could not prewarm connections to redis server %s: %s", connection_key, e)
+            finally:
+                for connection in opened:
+                    pool.release(connection)
+        return failed
 
 
 class SessionStore(SessionBase):
     """
     Implements Redis database session store.
     """
+    # True or False to save this session behind the response or not, None
+    # follows the 'write_behind' setting.
+    write_behind = None
+    # True once this store saved or deleted a session.
+    written = False
+    # True to read from the master, set by redis_sessions.middleware while
+    # the session was written in the last `read_your_writes` seconds.
+    written_recently = False
+    # RedisServer of the last session key routed, see _route().
+    _routed = None
+
     def __init__(self, session_key=None):
         super(SessionStore, self).__init__(session_key)
-        self.server = self.get_redis_server(session_key)
+        self.server = self._route().get()
+        # fingerprint of the loaded session and the expiry time of its key,
+        # used to skip rewriting unchanged sessions.
+        self._fingerprint = None
+        self._expires_at = None
+        # fingerprints of the loaded fields, in the hash storage.
+        self._fields = None
+        # stored value the session was loaded from, for versioned saves.
+        self._base = None
 
     # overriding this to support pickle serializer.
     def __getstate__(self):
@@ -113,91 +778,1137 @@ class SessionStore(SessionBase):
 
         # replace the server instance.
         state['server'] = self.session_key
+        state.pop('_routed', None)
 
         return state
 
     # overriding this to support pickle serializer.
     def __setstate__(self, new_state):
-        # recreate server instance
-        new_state['server'] = self.get_redis_server(new_state['server'])
+        session_key = new_state['server']
 
         # re-instate our __dict__ state from the pickled state
         self.__dict__.update(new_state)
 
+        # recreate server instance
+        self.server = self._route(session_key).get()
+
+    def _hash(self, value):
+        # SessionBase._hash was removed in Django 4.0, stored sessions keep
+        # being signed with it.
+        key_salt = "django.contrib.sessions" + self.__class__.__name__
+        return salted_hmac(key_salt, value).hexdigest()
+
+    @staticmethod
+    def _binary_format():
+        # compressed values need the codec recorded in the binary header.
+        return settings.SESSION_REDIS_FORMAT == 'binary' or settings.SESSION_REDIS_COMPRESSOR is not None
+
     # overriding the default encoding to reduce the amount
     def encode(self, session_dict):
         """Returns the given session dictionary serialized and encoded as a string."""
-        serialized = self.serializer().dumps(session_dict)
+        return self._pack(self.serializer().dumps(session_dict))
+
+    def _pack(self, serialized):
         hash = self._hash(serialized)
-        return base64.b64encode(hash.encode() + b":" + serialized)
+        if not self._binary_format():
+            return base64.b64encode(hash.encode() + b":" + serialized)
+
+        codec = CODEC_NONE
+        body = hash.encode() + b":" + serialized
+        compressor = get_compressor()
+        if compressor is not None and len(body) >= settings.SESSION_REDIS_COMPRESS_MIN_SIZE:
+            compressed = compressor.compress(body)
+            if len(compressed) < len(body):
+                codec, body = compressor.codec, compressed
+        return BINARY_HEADER.pack(BINARY_MARKER, BINARY_VERSION, codec) + body
+
+    def _unpack(self, session_data):
+        """
+        Returns the serialized session of a stored value, checking its hash.
+
+        It is a memoryview over the stored value (or over its decompressed or
+        base64 decoded body): the payload is not copied.
+        """
+        start = 0
+        if session_data.startswith(BINARY_MARKER):
+            _, version, codec = BINARY_HEADER.unpack_from(session_data)
+            if version != BINARY_VERSION:
+                raise ValueError("unsupported session format.")
+            if codec != CODEC_NONE:
+                body = get_decompressor(codec).decompress(memoryview(session_data)[BINARY_HEADER.size:])
+            else:
+                body, start = session_data, BINARY_HEADER.size
+        else:
+            body = base64.b64decode(session_data)
+        colon = body.find(b":", start)
+        if colon < 0:
+            raise ValueError("session data without hash.")
+        view = memoryview(body)
+        serialized = view[colon + 1:]
+        if not hmac.compare_digest(view[start:colon], self._hmac(serialized)):
+            raise SuspiciousSession("Session data corrupted")
+        return serialized
+
+    def _hmac(self, value):
+        """Returns ``_hash(value)`` as bytes, for any bytes-like ``value``."""
+        return hmac.new(self._hmac_key(), value, hashlib.sha1).hexdigest().encode()
+
+    def _hmac_key(self):
+        # the key salted_hmac derives for _hash, computed once.
+        key_salt = "django.contrib.sessions" + self.__class__.__name__
+        secret = django_settings.SECRET_KEY
+        key = _hmac_keys.get((key_salt, secret))
+        if key is None:
+            key = _hmac_keys[(key_salt, secret)] = hashlib.sha1(force_bytes(key_salt + secret)).digest()
+        return key
+
+    def _deserialize(self, serialized):
+        serializer = self.serializer()
+        if not getattr(serializer, 'accepts_buffer', False):
+            serialized = serialized.tobytes()
+        return serializer.loads(serialized)
+
+    def decode(self, session_data):
+        """
+        Decodes both binary and base64 values, whatever the configured format
+        is, so a keyspace can be migrated one save at a time.
+        """
+        return self._decode(force_bytes(session_data))[0]
+
+    def _decode(self, session_data, serialized=None):
+        """
+        Returns the decoded session and its serialized form, given already
+        when ``session_data`` comes from the near-cache.
+        """
+        try:
+            if serialized is None:
+                serialized = self._unpack(session_data)
+            return self._deserialize(serialized), serialized
+        except Exception as e:
+            # same behaviour as SessionBase.decode: any failure yields an
+            # empty session, tampering is logged.
+            self._log_suspicious(e)
+            return {}, None
+
+    def _decode_fields(self, stored, unpacked=None):
+        """
+        Returns the session stored in a hash and the fingerprints of its
+        fields, serialized by ``_unpack_fields`` already when ``stored``
+        comes from the near-cache.
+        """
+        session, fields = {}, {}
+        try:
+            if unpacked is None:
+                unpacked = self._unpack_fields(stored)
+            for field, serialized in unpacked.items():
+                session[field] = self._deserialize(serialized)
+                fields[field] = hashlib.sha1(serialized).digest()
+        except Exception as e:
+            self._log_suspicious(e)
+            return {}, None
+        return session, fields
+
+    def _unpack_fields(self, stored):
+        """Returns the serialized fields of a session stored in a hash, by name."""
+        return dict((field.decode(), self._unpack(value)) for field, value in stored.items() if field != HASH_MARKER)
+
+    def _unpack_stored(self, stored):
+        """
+        Returns the serialized form of a stored value (by field for a hash),
+        or None if it cannot be decoded; ``_load_stored`` then tells why.
+        """
+        try:
+            if isinstance(stored, dict):
+                return self._unpack_fields(stored)
+            return self._unpack(stored)
+        except Exception:
+            return None
+
+    @staticmethod
+    def _log_suspicious(e):
+        if isinstance(e, SuspiciousOperation):
+            security_logger = logging.getLogger('django.security.%s' % e.__class__.__name__)
+            security_logger.warning(force_unicode(e))
 
     @staticmethod
     def get_redis_server(session_key):
         return RedisServer(session_key).get()
 
-    def load(self):
+    def _route(self, session_key=None):
+        """
+        Returns the RedisServer of ``session_key``, the session key of this
+        store by default, resolved once per key.
+        """
+        if session_key is None:
+            session_key = self.session_key
+        routed = self._routed
+        if routed is None or routed.session_key != session_key:
+            routed = self._routed = RedisServer(session_key)
+        return routed
+
+    def _fetch(self, key):
+        """
+        Returns the stored value of ``key`` (bytes, or a dict of fields in the
+        hash storage), the time it expires at when known, and its serialized
+        form when it went through the near-cache.
+        """
+        stored = self._pending(key)
+        if stored is not None:
+            return stored, None, None
+        near_cache = get_near_cache()
+        entry = self._cached(near_cache, key) if near_cache is not None else None
+        if entry is not None:
+            return entry[1], None, entry[2]
+
+        # GETEX writes, sliding loads go to the master.
+        client = self.server if settings.SESSION_REDIS_SLIDING_EXPIRY else self._read_client(key)
+        version_key = self._version_key(key) if near_cache is not None else None
+        stored, expires_at, version = self._read(client, key, version_key)
+        if not stored and client is not self.server:
+            # created too recently to have reached the replica.
+            stored, expires_at, version = self._read(self.server, key, version_key)
+        if not stored and self._migrate(key):
+            stored, expires_at, version = self._read(self.server, key, version_key)
+
+        unpacked = None
+        if stored and near_cache is not None:
+            unpacked = self._unpack_stored(stored)
+            if unpacked is not None and self._cacheable(stored):
+                near_cache.set(key, (version, stored, unpacked))
+        return stored or None, expires_at, unpacked
+
+    def _cached(self, near_cache, key):
+        """
+        Returns the near-cache entry of ``key``: its version, stored value and
+        serialized form. Unless ``verify`` is off, the entry is dropped when
+        the stored version changed, which reads a few bytes: the HASH_MARKER
+        field of a hash, the version key of a string and whether it exists.
+        """
+        entry = near_cache.get(key)
+        if entry is None or not near_cache.verify:
+            return entry
         try:
-            session_data = self.server.get(
-                self.get_real_stored_key(self._get_or_create_session_key())
-            )
-            if session_data is None:
-                # force it to session key as none and return empty dict.
-                raise ValueError("session key does not exists.")
-            return self.decode(force_unicode(session_data))
-        except:
-            self._session_key = None
-            return {}
+            if settings.SESSION_REDIS_STORAGE == 'hash':
+                current = self.server.hget(key, HASH_MARKER)
+            else:
+                pipe = self.server.pipeline(transaction=False)
+                current, exists = pipe.get(self._version_key(key)).exists(key).execute()
+                if not exists:
+                    current = _missing
+        except redis.ResponseError:
+            # replaced by another type of value.
+            current = _missing
+        if current != entry[0]:
+            near_cache.delete(key)
+            return None
+        return entry
+
+    @staticmethod
+    def _version_key(key):
+        """Returns the key holding the version of a string session, None in the hash storage."""
+        if settings.SESSION_REDIS_STORAGE == 'hash':
+            return None
+        return key + VERSION_KEY_SUFFIX
+
+    @staticmethod
+    def _cacheable(stored):
+        """Tells if ``stored`` has its version where the configured storage reads it."""
+        return isinstance(stored, dict) == (settings.SESSION_REDIS_STORAGE == 'hash')
+
+    def _migrate(self, key):
+        """
+        Moves ``key`` from the server owning it in ``previous_pool``, if it
+        is another one. Returns True if it was moved.
+        """
+        previous = self._route().get_previous()
+        if previous is None:
+            return False
+        try:
+            return bool(_move(self, previous, self.server, [key]))
+        except redis.RedisError as e:
+            logger.warning("Could not move session from its previous redis server: %s", e)
+            return False
+
+    @staticmethod
+    def _pending(key):
+        """Returns the value of ``key`` waiting in the write-behind queue, if any."""
+        queue = get_write_behind()
+        return queue.get(key) if queue is not None else None
+
+    def _read(self, client, key, version_key=None):
+        """
+        Returns the stored value of ``key``, the time it expires at when
+        known, and its version: read from ``version_key`` if given, or from
+        the HASH_MARKER field of a hash.
+        """
+        hash_storage = settings.SESSION_REDIS_STORAGE == 'hash'
+        expires_at = version = None
+        try:
+            if version_key is not None:
+                stored, expires_at, version = self._read_versioned(client, key, version_key)
+            elif settings.SESSION_REDIS_SLIDING_EXPIRY:
+                stored = self._read_sliding(client, key, hash_storage)
+                expires_at = time.time() + django_settings.SESSION_COOKIE_AGE
+            elif settings.SESSION_REDIS_DIRTY_TRACKING:
+                # the remaining TTL rides along with the read.
+                pipe = client.pipeline(transaction=False)
+                if hash_storage:
+                    pipe.hgetall(key)
+                else:
+                    pipe.get(key)
+                stored, ttl = pipe.ttl(key).execute()
+                if ttl is not None and ttl >= 0:
+                    expires_at = time.time() + ttl
+            else:
+                stored = client.hgetall(key) if hash_storage else client.get(key)
+        except redis.ResponseError:
+            if not hash_storage:
+                raise
+            # a session written by the string storage, it is replaced by a
+            # hash on its next save.
+            stored = client.get(key)
+        if isinstance(stored, dict):
+            version = stored.get(HASH_MARKER)
+        return stored, expires_at, version
+
+    @staticmethod
+    def _read_versioned(client, key, version_key):
+        """
+        Reads a string session and the version in ``version_key`` in one
+        round trip, the version first: a value saved meanwhile comes with a
+        newer version, and misses the near-cache next time.
+        """
+        pipe = client.pipeline(transaction=False).get(version_key).get(key)
+        if settings.SESSION_REDIS_SLIDING_EXPIRY:
+            age = django_settings.SESSION_COOKIE_AGE
+            version, stored, _ = pipe.expire(key, age).execute()
+            return stored, time.time() + age, version
+        if settings.SESSION_REDIS_DIRTY_TRACKING:
+            version, stored, ttl = pipe.ttl(key).execute()
+            return stored, time.time() + ttl if ttl is not None and ttl >= 0 else None, version
+        version, stored = pipe.execute()
+        return stored, None, version
+
+    @staticmethod
+    def _read_sliding(client, key, hash_storage):
+        """
+        Reads ``key`` and sets its expiry to SESSION_COOKIE_AGE in the same
+        round trip; load() corrects it for sessions with their own expiry.
+        """
+        age = django_settings.SESSION_COOKIE_AGE
+        if not hash_storage and id(client) not in _no_getex:
+            try:
+                return client.execute_command('GETEX', key, 'EX', age)
+            except redis.ResponseError as e:
+                if 'unknown command' not in str(e).lower():
+                    raise
+                _no_getex.add(id(client))
+        pipe = client.pipeline(transaction=False)
+        if hash_storage:
+            pipe.hgetall(key)
+        else:
+            pipe.get(key)
+        return pipe.expire(key, age).execute()[0]
+
+    def _sliding_correction(self, session, expires_at):
+        """
+        Returns the expiry to set after a sliding load of a session with its
+        own expiry (see ``set_expiry()``), or None.
+        """
+        if not settings.SESSION_REDIS_SLIDING_EXPIRY or expires_at is None:
+            return None
+        age = self.get_expiry_age(expiry=session.get('_session_expiry'))
+        if age == django_settings.SESSION_COOKIE_AGE:
+            return None
+        self._expires_at = time.time() + age
+        return age
+
+    def _read_client(self, key, session_key=None):
+        """Returns the client to read ``key`` from: a replica, unless this process just wrote it."""
+        recent_writes = get_recent_writes()
+        server = self._route(session_key)
+        if recent_writes is None or self.written_recently or recent_writes.get(key) is not None:
+            return server.get()
+        return server.get_replica()
+
+    def _written(self, key):
+        self.written = True
+        recent_writes = get_recent_writes()
+        if recent_writes is not None:
+            recent_writes.set(key, True)
+
+    @property
+    def connection_key(self):
+        return self._route().connection_key
+
+    def guard(self, session_key):
+        """Returns the circuit breaker of the server of ``session_key``."""
+        if not settings.SESSION_REDIS_BREAKER_THRESHOLD:
+            return null_breaker
+        return self._route(session_key).guard()
+
+    def load(self):
+        with timed('load', self):
+            try:
+                key = self.get_real_stored_key(self._get_or_create_session_key())
+                with self.guard(self.session_key):
+                    fetched = self._fetch(key)
+                    if fetched[0] is None and settings.SESSION_REDIS_MIGRATE_FROM is not None:
+                        session = self._load_legacy()
+                        if session is not None:
+                            return session
+                session = self._load_stored(*fetched)
+                age = self._sliding_correction(session, fetched[1])
+                if age is not None:
+                    self.server.expire(key, age)
+                return session
+            except (redis.ConnectionError, redis.TimeoutError) as e:
+                self._load_failed(e)
+                return self._load_missing()
+            except Exception:
+                return self._load_missing()
+
+    def _load_failed(self, error):
+        # the session is lost for this request, make it visible.
+        if isinstance(error, CircuitOpenError):
+            record_load(self, 'circuit_open')
+        else:
+            record_load(self, 'connection_error')
+            logger.warning("Could not load session from redis: %s", error)
+
+    def _load_missing(self):
+        session_key, self._session_key = self._session_key, None
+        session = self._fallback_store(session_key).load() if self._fallback_engine() else {}
+        if session:
+            # saved by the fallback store during an outage, move it back.
+            self.modified = True
+        return session
+
+    def _legacy_store(self, session_key=None):
+        return import_module(settings.SESSION_REDIS_MIGRATE_FROM).SessionStore(session_key)
+
+    def _load_legacy(self):
+        """
+        Returns the session missing from redis from the ``migrate_from``
+        engine, after copying it here, or None if it is not there either.
+        """
+        legacy = self._legacy_store(self.session_key)
+        session, ttl = _read_legacy(legacy)
+        if not session or ttl <= 0:
+            return None
+        self._import(self._pipeline(self.server), session, ttl).execute()
+        record_load(self, 'migrated')
+        if settings.SESSION_REDIS_MIGRATE_DELETE:
+            legacy.delete()
+        return session
+
+    def _import(self, pipe, session, ttl):
+        """
+        Queues on ``pipe`` the commands storing ``session`` for ``ttl``
+        seconds, unless it was stored in the meantime.
+        """
+        key = self.get_real_stored_key(self.session_key)
+        self._session_cache = session
+        index_key = self._user_index_key()
+        if settings.SESSION_REDIS_STORAGE == 'hash':
+            keys = self._field_keys(key)
+            args = self._field_args(session)
+            # the session expiry.
+            args[0] = ttl
+            # EVAL rather than a registered script, which async pipelines
+            # would have to await.
+            pipe.eval(HASH_SAVE_SCRIPT, len(keys), *(keys + ['create'] + args))
+            index_key = self._separate_index_key()
+        else:
+            pipe.set(key, self._pack(self.serializer().dumps(session)), ex=ttl, nx=True)
+        if index_key is not None:
+            self._index_pipeline(pipe, index_key)
+        return pipe
+
+    @staticmethod
+    def _fallback_engine():
+        engine = settings.SESSION_REDIS_FALLBACK
+        return engine if engine not in (None, 'empty') else None
+
+    def _fallback_store(self, session_key=None):
+        return import_module(self._fallback_engine()).SessionStore(session_key)
+
+    def _fallback_save(self, session):
+        """Saves the session with the fallback engine, if any, while redis is unreachable."""
+        if self._fallback_engine() is None:
+            # read-only sessions.
+            return
+        fallback = self._fallback_store()
+        fallback._session_cache = session
+        fallback.save()
+        self._session_key = fallback.session_key
+
+    def _load_stored(self, stored, expires_at, unpacked=None):
+        if stored is None:
+            record_load(self, 'miss')
+            # force it to session key as none and return empty dict.
+            raise ValueError("session key does not exists.")
+        if isinstance(stored, dict):
+            session, self._fields = self._decode_fields(stored, unpacked)
+            self._expires_at = expires_at
+            if self._fields is None:
+                record_load(self, 'decode_error')
+            else:
+                record_load(self, 'hit', sum(len(value) for value in stored.values()))
+            return session
+        session, serialized = self._decode(stored, unpacked)
+        if serialized is None:
+            record_load(self, 'decode_error')
+            return session
+        record_load(self, 'hit', len(stored))
+        if settings.SESSION_REDIS_VERSIONED:
+            self._base = stored
+        # values in another format than the configured one are left
+        # untracked, so that the next save rewrites them.
+        if stored.startswith(BINARY_MARKER) == self._binary_format():
+            self._fingerprint = hashlib.sha1(serialized).digest()
+            self._expires_at = expires_at
+        return session
 
     def exists(self, session_key):
-        return self.server.exists(self.get_real_stored_key(session_key))
+        with timed('exists', self):
+            try:
+                with self.guard(session_key):
+                    # session_key may live on another server of the pool than this session.
+                    key = self.get_real_stored_key(session_key)
+                    return self._read_client(key, session_key).exists(key)
+            except (redis.ConnectionError, redis.TimeoutError):
+                if settings.SESSION_REDIS_FALLBACK is None:
+                    raise
+                # new session keys are random enough, let create() go on.
+                return False
 
     def create(self):
         while True:
             self._session_key = self._get_new_session_key()
+            self.server = self._route().get()
 
-            try:
-                self.save(must_create=True)
-            except CreateError:
-                # Key wasn't unique. Try again.
-                continue
+            with timed('create', self):
+                try:
+                    self.save(must_create=True)
+                except CreateError:
+                    # Key wasn't unique. Try again.
+                    record_create_retry(self)
+                    continue
+                self._prune_index()
             self.modified = True
             return
 
     def save(self, must_create=False):
         if self.session_key is None:
             return self.create()
-        if must_create and self.exists(self._get_or_create_session_key()):
-            raise CreateError
-        data = self.encode(self._get_session(no_load=must_create))
-        if redis.VERSION[0] >= 2:
-            self.server.setex(
-                self.get_real_stored_key(self._get_or_create_session_key()),
-                self.get_expiry_age(),
-                data
-            )
+        with timed('save', self):
+            try:
+                with self.guard(self.session_key):
+                    self._save(must_create)
+            except (redis.ConnectionError, redis.TimeoutError):
+                if settings.SESSION_REDIS_FALLBACK is None:
+                    raise
+                self._fallback_save(self._get_session(no_load=True))
+
+    def _save(self, must_create):
+        key = self.get_real_stored_key(self._get_or_create_session_key())
+        if settings.SESSION_REDIS_STORAGE == 'hash':
+            return self._save_fields(key, must_create)
+
+        serialized = self.serializer().dumps(self._get_session(no_load=must_create))
+        fingerprint = hashlib.sha1(serialized).digest()
+        if (not must_create and self._dirty_tracking()
+                and fingerprint == self._fingerprint and self._touch(key)):
+            return
+
+        data = self._pack(serialized)
+        record_save(self, len(data))
+        index_key = self._user_index_key()
+        # a new session has no version yet, it starts with the first update.
+        version = _new_version() if not must_create and get_near_cache() is not None else None
+        if must_create:
+            # SET NX EX creates the key and sets its expiry atomically, in a
+            # single round trip; it returns None when the key already exists.
+            created = self.server.set(key, data, ex=self.get_expiry_age(), nx=True)
+            if not created:
+                raise CreateError
+            if index_key is not None:
+                self._index_pipeline(self._pipeline(self.server), index_key).execute()
+        elif settings.SESSION_REDIS_VERSIONED:
+            return self._save_versioned(key, data, fingerprint, serialized, version)
+        elif self._save_behind(key, data, index_key, version):
+            # written by the write-behind thread.
+            pass
+        elif index_key is not None or version is not None:
+            pipe = self._pipeline(self.server)
+            pipe.setex(key, self.get_expiry_age(), data)
+            if index_key is not None:
+                self._index_pipeline(pipe, index_key)
+            if version is not None:
+                self._version_pipeline(pipe, key, version)
+            pipe.execute()
+        elif redis.VERSION[0] >= 2:
+            self.server.setex(key, self.get_expiry_age(), data)
         else:
-            self.server.set(
-                self.get_real_stored_key(self._get_or_create_session_key()),
-                data
-            )
-            self.server.expire(
-                self.get_real_stored_key(self._get_or_create_session_key()),
-                self.get_expiry_age()
-            )
+            self.server.set(key, data)
+            self.server.expire(key, self.get_expiry_age())
+        self._saved(key, data, fingerprint, version, serialized)
+
+    def _save_behind(self, key, data, index_key, version=None):
+        """
+        Queues the write of the session when it is saved behind the response.
+        Returns False if it is not, or if the queue is full.
+        """
+        queue = get_write_behind()
+        if queue is None:
+            return False
+        write_behind = self.write_behind
+        if write_behind is None:
+            write_behind = settings.SESSION_REDIS_WRITE_BEHIND.get('default', True)
+        if not write_behind:
+            return False
+        index = None
+        if index_key is not None:
+            index = (index_key, self.session_key, self._user_index_age())
+        if version is not None:
+            version = (self._version_key(key), version)
+        return queue.put(key, self.server, data, self.get_expiry_age(), index, version)
+
+    def _save_versioned(self, key, data, fingerprint, serialized, version=None):
+        """
+        Writes the session with VERSIONED_SAVE_SCRIPT. When another request
+        saved it since it was loaded, the changes made here are merged into
+        that value and the merge is written the same way.
+        """
+        save = _script(self.server, VERSIONED_SAVE_SCRIPT)
+        keys = self._field_keys(key)
+        for retry in range(settings.SESSION_REDIS_VERSIONED_RETRIES + 1):
+            args = self._versioned_args(data, retry)
+            written = save(keys=keys, args=args, client=self.server)
+            if written[0]:
+                break
+            data, fingerprint, serialized = self._merge(written[1])
+        pipe = self._after_versioned_save(self.server, key, version)
+        if pipe is not None:
+            pipe.execute()
+        self._saved(key, data, fingerprint, version, serialized)
+
+    def _after_versioned_save(self, client, key, version):
+        """
+        Returns the pipeline writing what VERSIONED_SAVE_SCRIPT does not: the
+        version of the session, and the user index in a cluster. None if
+        there is nothing to write.
+        """
+        index_key = self._separate_index_key()
+        if index_key is None and version is None:
+            return None
+        pipe = self._pipeline(client)
+        if index_key is not None:
+            self._index_pipeline(pipe, index_key)
+        if version is not None:
+            self._version_pipeline(pipe, key, version)
+        return pipe
+
+    def _version_pipeline(self, pipe, key, version):
+        """Queues on ``pipe`` the write of the version of the string session saved to ``key``."""
+        pipe.set(self._version_key(key), version, ex=self.get_expiry_age())
+        return pipe
+
+    def _versioned_args(self, data, retry):
+        if retry == settings.SESSION_REDIS_VERSIONED_RETRIES:
+            # still racing, the last write wins.
+            version = '*'
+        elif self._base is None:
+            version = ''
+        else:
+            version = hashlib.sha1(self._base).hexdigest()
+        return [version, data, self.get_expiry_age(), self.session_key, self._user_index_age()]
+
+    def _merge(self, current):
+        """
+        Applies the changes made to the session since it was loaded to
+        ``current``, the value saved meanwhile, and returns the value to
+        store, its fingerprint and its serialized form.
+        """
+        if current is None:
+            # deleted meanwhile, e.g. by a logout: do not bring it back.
+            raise UpdateError
+        base = self._decode(self._base)[0] if self._base is not None else {}
+        merged = self._decode(current)[0]
+        session = self._get_session()
+        for name in set(base) | set(session):
+            value = session.get(name, _missing)
+            if value == base.get(name, _missing):
+                continue
+            if value is _missing:
+                merged.pop(name, None)
+            else:
+                merged[name] = value
+        self._session_cache = merged
+        self._base = current
+        serialized = self.serializer().dumps(merged)
+        return self._pack(serialized), hashlib.sha1(serialized).digest(), serialized
+
+    def _saved(self, key, data, fingerprint, version=None, serialized=None):
+        self._written(key)
+        if settings.SESSION_REDIS_VERSIONED:
+            self._base = data
+        self._fingerprint = fingerprint
+        self._expires_at = time.time() + self.get_expiry_age()
+
+        near_cache = get_near_cache()
+        if near_cache is not None:
+            near_cache.set(key, (version, data, memoryview(serialized)))
+
+    def _save_fields(self, key, must_create):
+        """Writes the fields of a session stored in a hash that changed since it was loaded."""
+        session = self._get_session(no_load=must_create)
+        mode, args, fields = self._field_changes(session, must_create)
+        if mode is None:
+            if self._touch(key):
+                return
+            mode = 'update'
+
+        save = _script(self.server, HASH_SAVE_SCRIPT)
+        keys = self._field_keys(key)
+        if not save(keys=keys, args=[mode] + args, client=self.server):
+            if mode == 'create':
+                raise CreateError
+            # the key is gone, write the session in full.
+            save(keys=keys, args=['replace'] + self._field_args(session), client=self.server)
+        index_key = self._separate_index_key()
+        if index_key is not None:
+            self._index_pipeline(self._pipeline(self.server), index_key).execute()
+        self._fields_saved(key, fields)
+
+    def _field_changes(self, session, must_create):
+        """
+        Returns the mode and arguments of HASH_SAVE_SCRIPT to save ``session``
+        and the fingerprints of its fields. The mode is None when nothing
+        changed and only the expiry needs a refresh.
+        """
+        loaded = {} if must_create or self._fields is None else self._fields
+        fields, changed = {}, []
+        for field, value in session.items():
+            serialized = self.serializer().dumps(value)
+            fields[field] = hashlib.sha1(serialized).digest()
+            if loaded.get(field) != fields[field]:
+                changed.extend([field, self._pack(serialized)])
+        removed = [field for field in loaded if field not in session]
+
+        if must_create:
+            mode = 'create'
+        elif self._fields is None:
+            # not loaded from a hash: replace whatever is stored.
+            mode = 'replace'
+        elif not changed and not removed and self._dirty_tracking():
+            mode = None
+        else:
+            mode = 'update'
+        args = self._field_index_args() + [len(removed)] + removed + [HASH_MARKER, _new_version()] + changed
+        return mode, args, fields
+
+    def _field_args(self, session):
+        """Returns the HASH_SAVE_SCRIPT arguments writing all of ``session``."""
+        args = self._field_index_args() + [0, HASH_MARKER, _new_version()]
+        for field, value in session.items():
+            args.extend([field, self._pack(self.serializer().dumps(value))])
+        return args
+
+    def _field_keys(self, key):
+        index_key = self._user_index_key()
+        if index_key is None or settings.SESSION_REDIS_CLUSTER is not None:
+            return [key]
+        return [key, index_key]
+
+    def _separate_index_key(self):
+        """
+        Returns the user index key when HASH_SAVE_SCRIPT cannot update it: in
+        a cluster it is in another slot than the session.
+        """
+        if settings.SESSION_REDIS_CLUSTER is None:
+            return None
+        return self._user_index_key()
+
+    def _field_index_args(self):
+        return [self.get_expiry_age(), self.session_key, self._user_index_age()]
+
+    def _fields_saved(self, key, fields):
+        self._written(key)
+        self._fields = fields
+        self._expires_at = time.time() + self.get_expiry_age()
+
+        near_cache = get_near_cache()
+        if near_cache is not None:
+            # only the changed fields were written, the next load reads them all.
+            near_cache.delete(key)
+
+        near_cache = get_near_cache()
+        if near_cache is not None:
+            near_cache.delete(key)
+
+    def _touch(self, key):
+        """
+        Refreshes the expiry of an unchanged session. Returns False when the
+        key is gone and the session has to be written in full.
+        """
+        if self._expiry_within_slack():
+            return True
+        index_key = self._user_index_key()
+        if index_key is None:
+            touched = self.server.expire(key, self.get_expiry_age())
+        else:
+            pipe = self._pipeline(self.server)
+            pipe.expire(key, self.get_expiry_age())
+            touched = self._index_pipeline(pipe, index_key).execute()[0]
+        if not touched:
+            return False
+        self._expires_at = time.time() + self.get_expiry_age()
+        return True
+
+    def _user_index_key(self, user_id=None):
+        """
+        Returns the key of the set indexing the sessions of ``user_id`` (by
+        default, the user logged in this session), or None if sessions are
+        not indexed.
+        """
+        if not settings.SESSION_REDIS_USER_INDEX:
+            return None
+        if user_id is None:
+            user_id = self._get_session().get(USER_ID_SESSION_KEY)
+            if user_id is None:
+                return None
+        return self.get_real_stored_key('user:%s' % user_id)
+
+    def _user_index_age(self):
+        # the index lives as long as the longest lived session of the user.
+        return max(self.get_expiry_age(), django_settings.SESSION_COOKIE_AGE)
+
+    @staticmethod
+    def _pipeline(client):
+        # a cluster cannot run a transaction over the session and index slots.
+        return client.pipeline(transaction=settings.SESSION_REDIS_CLUSTER is None)
+
+    def _index_pipeline(self, pipe, index_key):
+        pipe.sadd(index_key, self.session_key)
+        pipe.expire(index_key, self._user_index_age())
+        return pipe
+
+    def _prune_index(self):
+        """
+        Removes the sessions gone from the index of the user of a new session,
+        e.g. the expired ones, or the index of a user logging in again and
+        again would only grow. Logins cycle the session key, so it runs once
+        per login.
+        """
+        index_key = self._user_index_key()
+        if index_key is None:
+            return
+        try:
+            with self.guard(self.session_key):
+                session_keys = list(self.server.smembers(index_key))
+                pipe = self.server.pipeline(transaction=False)
+                for session_key in session_keys:
+                    pipe.exists(self.get_real_stored_key(session_key.decode()))
+                gone = [session_key for session_key, exists in zip(session_keys, pipe.execute()) if not exists]
+                if gone:
+                    self.server.srem(index_key, *gone)
+        except redis.RedisError as e:
+            # the next login prunes it.
+            logger.warning("Could not prune the user index: %s", e)
+
+    def _deleted_index_key(self, session_key, key):
+        """
+        Returns the user index key of a session about to be deleted, from
+        this session if it is the loaded one, else read from redis.
+        """
+        if not settings.SESSION_REDIS_USER_INDEX:
+            return None
+        session = getattr(self, '_session_cache', None) if session_key == self.session_key else None
+        if session is None:
+            session = self._stored_session(self._read(self._route(session_key).get(), key)[0])
+        return self._session_index_key(session)
+
+    def _stored_session(self, stored):
+        if not stored:
+            return {}
+        if isinstance(stored, dict):
+            return self._decode_fields(stored)[0]
+        return self._decode(stored)[0]
+
+    def _session_index_key(self, session):
+        user_id = session.get(USER_ID_SESSION_KEY)
+        return None if user_id is None else self._user_index_key(user_id)
+
+    def _moved_index(self, stored):
+        """
+        Returns the user index key of a stored session and how long the index
+        should live, or None if the session is not indexed.
+        """
+        session = self._stored_session(stored)
+        index_key = self._session_index_key(session)
+        if index_key is None:
+            return None
+        age = self.get_expiry_age(expiry=session.get('_session_expiry'))
+        return index_key, max(age, django_settings.SESSION_COOKIE_AGE)
+
+    @classmethod
+    def delete_user_sessions(cls, user_id):
+        """
+        Deletes all the sessions of a user, with one round trip per server.
+        Requires the ``user_index`` setting. Returns how many were deleted.
+        """
+        store = cls()
+        index_key = store._user_index_key(user_id)
+        if index_key is None:
+            raise ValueError("deleting the sessions of a user requires SESSION_REDIS['user_index'].")
+        if settings.SESSION_REDIS_CLUSTER is not None:
+            servers = [(None, RedisServer(None).get())]
+        else:
+            servers = RedisServer.get_all()
+        # sessions not moved yet are indexed on their previous server.
+        servers += RedisServer.get_all_retired()
+        deleted, missing = set(), set()
+        for _, client in servers:
+            server_deleted, server_missing = store._delete_indexed(client, index_key)
+            deleted.update(session_key.decode() for session_key in server_deleted)
+            missing.update(session_key.decode() for session_key in server_missing)
+        missing -= deleted
+        session_keys = deleted | missing
+        cls._forget(session_keys)
+        count = len(deleted)
+        if RedisServer.get_previous_routing()[1] is not None:
+            # sessions indexed on one pool may be stored on the other.
+            count += cls._delete_stored(missing)
+            count += cls._delete_stored(session_keys, previous=True)
+        cls._delete_legacy(session_keys)
+        return count
+
+    def _delete_indexed(self, client, index_key):
+        """
+        Deletes the sessions indexed in ``index_key`` on ``client``, and
+        returns the session keys deleted and the ones not found there.
+        """
+        if settings.SESSION_REDIS_CLUSTER is None:
+            delete = _script(client, DELETE_USER_SESSIONS_SCRIPT)
+            return delete(keys=[index_key], args=self._key_affixes(), client=client)
+        # the sessions are spread over the slots, out of reach of a script.
+        session_keys = list(client.smembers(index_key))
+        pipe = client.pipeline(transaction=False)
+        for session_key in session_keys:
+            pipe.unlink(self.get_real_stored_key(session_key.decode()))
+        replies = pipe.execute() if session_keys else []
+        deleted = [session_key for session_key, reply in zip(session_keys, replies) if reply]
+        missing = [session_key for session_key, reply in zip(session_keys, replies) if not reply]
+        if deleted:
+            # sessions indexed meanwhile stay in the index.
+            client.srem(index_key, *deleted)
+        return deleted, missing
+
+    @staticmethod
+    def _dirty_tracking():
+        return settings.SESSION_REDIS_DIRTY_TRACKING or settings.SESSION_REDIS_SLIDING_EXPIRY
+
+    def _expiry_within_slack(self):
+        if self._expires_at is None:
+            return False
+        if settings.SESSION_REDIS_SLIDING_EXPIRY:
+            # pushed forward by the load, or the save, of this session. Its
+            # own expiry cannot change without changing the session.
+            return True
+        expires_at = time.time() + self.get_expiry_age()
+        return abs(expires_at - self._expires_at) <= settings.SESSION_REDIS_TOUCH_SLACK
 
     def delete(self, session_key=None):
         if session_key is None:
             if self.session_key is None:
                 return
             session_key = self.session_key
-        try:
-            self.server.delete(self.get_real_stored_key(session_key))
-        except:
-            pass
+        key = self.get_real_stored_key(session_key)
+        near_cache = get_near_cache()
+        if near_cache is not None:
+            near_cache.delete(key)
+        queue = get_write_behind()
+        if queue is not None:
+            queue.discard(key)
+        self._written(key)
+        with timed('delete', self):
+            try:
+                with self.guard(session_key):
+                    server = self._route(session_key).get()
+                    index_key = self._deleted_index_key(session_key, key)
+                    if index_key is None:
+                        server.delete(key)
+                    else:
+                        self._pipeline(server).delete(key).srem(index_key, session_key).execute()
+                previous = self._route(session_key).get_previous()
+                if previous is not None:
+                    # or the next load would move it back.
+                    previous.delete(key)
+                if settings.SESSION_REDIS_MIGRATE_FROM is not None:
+                    self._legacy_store(session_key).delete(session_key)
+            except Exception:
+                pass
+
+    @classmethod
+    def iter_load_many(cls, session_keys, chunk_size=500):
+        """
+        Yields ``(session_key, session)`` for the given session keys that
+        exist, with one MGET (or pipelined HGETALLs) per chunk of keys on
+        each server.
+        """
+        store = cls()
+        for server, server_keys in cls._group_by_server(session_keys):
+            client = server.get()
+            for chunk in _chunks(server_keys, chunk_size):
+                keys = [store.get_real_stored_key(session_key) for session_key in chunk]
+                if settings.SESSION_REDIS_STORAGE == 'hash':
+                    pipe = client.pipeline(transaction=False)
+                    for key in keys:
+                        pipe.hgetall(key)
+                    values = pipe.execute()
+                elif settings.SESSION_REDIS_CLUSTER is not None:
+                    values = client.mget_nonatomic(keys)
+                else:
+                    values = client.mget(keys)
+                for session_key, stored in zip(chunk, values):
+                    if stored:
+                        if isinstance(stored, dict):
+                            yield session_key, store._decode_fields(stored)[0]
+                        else:
+                            yield session_key, store._decode(stored)[0]
+
+    @classmethod
+    def load_many(cls, session_keys, chunk_size=500):
+        """Returns a dict of the sessions of the given keys that exist."""
+        return dict(cls.iter_load_many(session_keys, chunk_size))
+
+    @classmethod
+    def exists_many(cls, session_keys, chunk_size=500):
+        """Returns a dict telling for each session key if it exists."""
+        store = cls()
+        result = {}
+        for server, server_keys in cls._group_by_server(session_keys):
+            client = server.get()
+            for chunk in _chunks(server_keys, chunk_size):
+                pipe = client.pipeline(transaction=False)
+                for session_key in chunk:
+                    pipe.exists(store.get_real_stored_key(session_key))
+                for session_key, exists in zip(chunk, pipe.execute()):
+                    result[session_key] = bool(exists)
+        return result
+
+    @classmethod
+    def delete_many(cls, session_keys, chunk_size=500):
+        """Deletes the sessions of the given keys, returns how many existed."""
+        session_keys = list(session_keys)
+        if settings.SESSION_REDIS_USER_INDEX:
+            cls._unindex(session_keys, chunk_size)
+        cls._forget(session_keys)
+        deleted = cls._delete_stored(session_keys, chunk_size)
+        # or the next load would move them back.
+        deleted += cls._delete_stored(session_keys, chunk_size, previous=True)
+        cls._delete_legacy(session_keys, chunk_size)
+        return deleted
+
+    @classmethod
+    def _unindex(cls, session_keys, chunk_size=500):
+        """Removes the given sessions from the index of their user, with one pipeline per server."""
+        store = cls()
+        pipes = {}
+        for session_key, session in cls.iter_load_many(session_keys, chunk_size):
+            index_key = store._session_index_key(session)
+            if index_key is None:
+                continue
+            server = RedisServer(session_key)
+            pipe = pipes.get(server.connection_key)
+            if pipe is None:
+                pipe = pipes[server.connection_key] = server.get().pipeline(transaction=False)
+            pipe.srem(index_key, session_key)
+        for pipe in pipes.values():
+            pipe.execute()
+
+    @classmethod
+    def _forget(cls, session_keys):
+        """Drops the given sessions from the near cache and the write-behind queue."""
+        store = cls()
+        near_cache = get_near_cache()
+        queue = get_write_behind()
+        for session_key in session_keys:
+            key = store.get_real_stored_key(session_key)
+            if near_cache is not None:
+                near_cache.delete(key)
+            if queue is not None:
+                queue.discard(key)
+
+    @classmethod
+    def _delete_stored(cls, session_keys, chunk_size=500, previous=False):
+        """
+        Unlinks the given sessions on their server, or on their server in
+        ``previous_pool``. Returns how many existed.
+        """
+        store = cls()
+        deleted = 0
+        groups = cls._group_by_previous_server(session_keys) if previous else cls._group_by_server(session_keys)
+        for server, server_keys in groups:
+            client = server.get_previous() if previous else server.get()
+            for chunk in _chunks(server_keys, chunk_size):
+                deleted += _unlink(client, [store.get_real_stored_key(session_key) for session_key in chunk])
+        return deleted
+
+    @classmethod
+    def _delete_legacy(cls, session_keys, chunk_size=500):
+        """
+        Deletes the given sessions from the ``migrate_from`` engine, or the
+        next load would import them again.
+        """
+        if settings.SESSION_REDIS_MIGRATE_FROM is None:
+            return
+        legacy = cls()._legacy_store()
+        model = getattr(legacy, 'model', None)
+        if model is None or hasattr(legacy, 'cache_key_prefix'):
+            # no table, or a cache in front of it.
+            for session_key in session_keys:
+                legacy.delete(session_key)
+            return
+        for chunk in _chunks(list(session_keys), chunk_size):
+            model.objects.filter(session_key__in=chunk).delete()
+
+    @staticmethod
+    def _group_by_server(session_keys):
+        """Returns ``(server, session keys)`` pairs, grouping keys by the server storing them."""
+        servers = {}
+        for session_key in session_keys:
+            server = RedisServer(session_key)
+            servers.setdefault(server.connection_key, (server, []))[1].append(session_key)
+        return servers.values()
+
+    @staticmethod
+    def _group_by_previous_server(session_keys):
+        """Same as ``_group_by_server``, for the keys stored elsewhere in ``previous_pool``."""
+        servers = {}
+        if RedisServer.get_previous_routing()[1] is None:
+            return servers.values()
+        for session_key in session_keys:
+            server = RedisServer(session_key)
+            config = server.previous_config()
+            if config is not None:
+                servers.setdefault(config.connection_key, (server, []))[1].append(session_key)
+        return servers.values()
 
     @classmethod
     def clear_expired(cls):
-        pass
+        """
+        Redis expires sessions by itself; this deletes the session keys that
+        were left without an expiry, which would otherwise live forever.
+        Without a ``prefix`` session keys cannot be told from other keys, and
+        nothing is deleted.
+        """
+        if not settings.SESSION_REDIS_PREFIX:
+            return
+        from redis_sessions.maintenance import sweep
+        sweep(cls, no_ttl=True, rate=settings.SESSION_REDIS_SWEEP_RATE)
         
     def get_real_stored_key(self, session_key):
         """Return the real key name in redis storage
@@ -210,7 +1921,20 @@ class SessionStore(SessionBase):
         else:
             session_key = str(session_key)
 
+        if settings.SESSION_REDIS_HASH_TAGS:
+            # only the session key is hashed to pick the cluster slot.
+            session_key = '{%s}' % session_key
+
         prefix = settings.SESSION_REDIS_PREFIX
         if not prefix:
             return session_key
         return ':'.join([prefix, session_key])
+
+    def get_session_key(self, stored_key):
+        """Returns the session key of a key name returned by get_real_stored_key."""
+        before, after = self._key_affixes()
+        return stored_key[len(before):len(stored_key) - len(after)]
+
+    def _key_affixes(self):
+        before, _, after = self.get_real_stored_key('*').rpartition('*')
+        return [before, after]
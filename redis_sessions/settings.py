@@ -7,11 +7,80 @@ SESSION_REDIS_HOST = SESSION_REDIS.get('host', 'localhost')
 SESSION_REDIS_PORT = SESSION_REDIS.get('port', 6379)
 SESSION_REDIS_SOCKET_TIMEOUT = SESSION_REDIS.get('socket_timeout', 0.1)
 SESSION_REDIS_RETRY_ON_TIMEOUT = SESSION_REDIS.get('retry_on_timeout', False)
+
+# connection pool options, also accepted per pool entry. Unset ones keep the
+# redis-py defaults.
+SESSION_REDIS_MAX_CONNECTIONS = SESSION_REDIS.get('max_connections', None)
+# wait up to `blocking_pool_timeout` seconds for a free connection instead of
+# raising once `max_connections` are in use.
+SESSION_REDIS_BLOCKING_POOL = SESSION_REDIS.get('blocking_pool', False)
+SESSION_REDIS_BLOCKING_POOL_TIMEOUT = SESSION_REDIS.get('blocking_pool_timeout', 20)
+SESSION_REDIS_SOCKET_CONNECT_TIMEOUT = SESSION_REDIS.get('socket_connect_timeout', None)
+SESSION_REDIS_SOCKET_KEEPALIVE = SESSION_REDIS.get('socket_keepalive', None)
+SESSION_REDIS_SOCKET_KEEPALIVE_OPTIONS = SESSION_REDIS.get('socket_keepalive_options', None)
+SESSION_REDIS_HEALTH_CHECK_INTERVAL = SESSION_REDIS.get('health_check_interval', None)
+# connections opened and checked per server when the app is ready, 0 disables.
+SESSION_REDIS_PREWARM = SESSION_REDIS.get('prewarm', 0)
 SESSION_REDIS_DB = SESSION_REDIS.get('db', 0)
 SESSION_REDIS_PREFIX = SESSION_REDIS.get('prefix', '')
 SESSION_REDIS_PASSWORD = SESSION_REDIS.get('password', None)
 SESSION_REDIS_UNIX_DOMAIN_SOCKET_PATH = SESSION_REDIS.get('unix_domain_socket_path', None)
 SESSION_REDIS_URL = SESSION_REDIS.get('url', None)
+# 'base64' (default) or 'binary'. Both formats are always readable.
+SESSION_REDIS_FORMAT = SESSION_REDIS.get('format', 'base64')
+# dotted path to a compressor class, e.g. 'redis_sessions.compressors.ZlibCompressor'.
+# Setting a compressor implies the binary format.
+SESSION_REDIS_COMPRESSOR = SESSION_REDIS.get('compressor', None)
+SESSION_REDIS_COMPRESSOR_OPTIONS = SESSION_REDIS.get('compressor_options', {})
+# zlib dictionaries (bytes or paths) of stored sessions, readable even with
+# compression disabled or another compressor.
+SESSION_REDIS_PREVIOUS_DICTIONARIES = SESSION_REDIS.get('previous_dictionaries', ())
+# payloads smaller than this (in bytes) are stored uncompressed.
+SESSION_REDIS_COMPRESS_MIN_SIZE = SESSION_REDIS.get('compress_min_size', 512)
+# per-process cache in front of load(), e.g. {'max_size': 1000, 'ttl': 1.0}.
+# Hits are checked against redis unless 'verify' is False.
+SESSION_REDIS_NEAR_CACHE = SESSION_REDIS.get('near_cache', None)
+# serializer reading the payloads the redis_sessions.serializers classes
+# cannot, i.e. the ones of the previous SESSION_SERIALIZER. None disables it.
+SESSION_REDIS_SERIALIZER_FALLBACK = SESSION_REDIS.get(
+    'serializer_fallback', 'django.contrib.sessions.serializers.JSONSerializer')
+# send load() and exists() to the replicas: `slave_for` with Sentinel, a
+# replica with `read_from_replicas` in a cluster, the `replicas` of the
+# server (or pool entry) otherwise.
+SESSION_REDIS_READ_FROM_REPLICAS = SESSION_REDIS.get('read_from_replicas', False)
+SESSION_REDIS_REPLICAS = SESSION_REDIS.get('replicas', None)
+# seconds after a save during which this process reads the session from the
+# master, so that it does not miss its own writes because of replication lag.
+SESSION_REDIS_READ_YOUR_WRITES = SESSION_REDIS.get('read_your_writes', 5)
+# how many written keys a process remembers for that window.
+SESSION_REDIS_READ_YOUR_WRITES_MAX_SIZE = SESSION_REDIS.get('read_your_writes_max_size', 10000)
+# the cookie redis_sessions.middleware.SessionMiddleware sets for that window,
+# so that every worker reads the session from the master.
+SESSION_REDIS_READ_YOUR_WRITES_COOKIE = SESSION_REDIS.get('read_your_writes_cookie', 'sessionwritten')
+# skip rewriting unchanged sessions on save, only refreshing their expiry
+# when it drifted by more than touch_slack seconds.
+SESSION_REDIS_DIRTY_TRACKING = SESSION_REDIS.get('dirty_tracking', False)
+SESSION_REDIS_TOUCH_SLACK = SESSION_REDIS.get('touch_slack', 0)
+# push the expiry of a session forward when it is loaded, with GETEX (Redis
+# >= 6.2) or GET + EXPIRE, and skip saving it when it did not change.
+SESSION_REDIS_SLIDING_EXPIRY = SESSION_REDIS.get('sliding_expiry', False)
+# save a session only if it was not saved by another request since it was
+# loaded; otherwise merge the changes into the saved one and try again, up to
+# `versioned_retries` times before overwriting it. String storage only.
+SESSION_REDIS_VERSIONED = SESSION_REDIS.get('versioned', False)
+SESSION_REDIS_VERSIONED_RETRIES = SESSION_REDIS.get('versioned_retries', 3)
+# write saves from a background thread, e.g. {'max_size': 10000,
+# 'batch_size': 500, 'interval': 0.005, 'when_full': 'sync', 'default': True}.
+# 'default' False only writes behind the sessions with `write_behind = True`.
+SESSION_REDIS_WRITE_BEHIND = SESSION_REDIS.get('write_behind', None)
+# 'string' (default) stores a session as one value, 'hash' stores each of
+# its keys as a field of a redis hash.
+SESSION_REDIS_STORAGE = SESSION_REDIS.get('storage', 'string')
+# keep a set of the session keys of every logged in user, so that all the
+# sessions of a user can be deleted at once.
+SESSION_REDIS_USER_INDEX = SESSION_REDIS.get('user_index', False)
+# dotted path to a metrics sink class, e.g. 'redis_sessions.metrics.PrometheusSink'.
+SESSION_REDIS_METRICS = SESSION_REDIS.get('metrics', None)
 
 
 """
@@ -37,7 +106,43 @@ Should be on the format:
     },
 ]
 """
-SESSION_REDIS_POOL = SESSION_REDIS.get('POOL', None)
+SESSION_REDIS_POOL = SESSION_REDIS.get('POOL', SESSION_REDIS.get('pool', None))
+# how session keys are spread over the pool: 'modulo' (default) or 'ring',
+# a consistent hash ring which only moves about 1/N of the sessions when a
+# server is added or removed.
+SESSION_REDIS_POOL_ROUTER = SESSION_REDIS.get('pool_router', 'modulo')
+# the pool (and router) before the last change of `POOL`, on the same
+# format. Sessions missing from their new server are moved from their
+# previous one on load, the `rebalancesessions` command moves the others.
+SESSION_REDIS_PREVIOUS_POOL = SESSION_REDIS.get('previous_pool', None)
+SESSION_REDIS_PREVIOUS_POOL_ROUTER = SESSION_REDIS.get('previous_pool_router', SESSION_REDIS_POOL_ROUTER)
+
+# consecutive connection errors/timeouts after which a server is not called
+# for `breaker_cooldown` seconds, 0 disables the circuit breaker.
+SESSION_REDIS_BREAKER_THRESHOLD = SESSION_REDIS.get('breaker_threshold', 0)
+SESSION_REDIS_BREAKER_COOLDOWN = SESSION_REDIS.get('breaker_cooldown', 30)
+# what sessions do while their server is unreachable: None raises on save,
+# 'empty' gives read-only empty sessions, a session engine path (e.g.
+# 'django.contrib.sessions.backends.signed_cookies') stores them there.
+SESSION_REDIS_FALLBACK = SESSION_REDIS.get('fallback', None)
+
+# session engine sessions are being moved from, e.g.
+# 'django.contrib.sessions.backends.db': sessions missing from redis are
+# read there and copied here with their remaining expiry. With
+# `migrate_delete` the copied sessions are deleted from it.
+SESSION_REDIS_MIGRATE_FROM = SESSION_REDIS.get('migrate_from', None)
+SESSION_REDIS_MIGRATE_DELETE = SESSION_REDIS.get('migrate_delete', False)
+
+# keys examined per second by `clearsessions` and `sweepsessions` (unless
+# given `--rate`), so sweeps do not load busy servers. 0 disables the limit.
+SESSION_REDIS_SWEEP_RATE = SESSION_REDIS.get('sweep_rate', 5000)
+
+# startup nodes of a Redis Cluster, on the format
+# [{'host': 'node1', 'port': 6379}, {'host': 'node2', 'port': 6379}]
+SESSION_REDIS_CLUSTER = SESSION_REDIS.get('cluster', None)
+# store sessions under `prefix:{session_key}`, so that keys derived from a
+# session key share its cluster slot. Always on with a cluster.
+SESSION_REDIS_HASH_TAGS = SESSION_REDIS.get('hash_tags', SESSION_REDIS_CLUSTER is not None)
 
 # should be on the format [(host, port), (host, port), (host, port)]
 SESSION_REDIS_SENTINEL_LIST = getattr(settings, 'SESSION_REDIS_SENTINEL_LIST', None)
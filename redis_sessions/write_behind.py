@@ -0,0 +1,194 @@
+"""
+Write-behind queue of session saves.
+
+Saves are put in a bounded per-process queue and written by a daemon thread
+in pipelined batches, one pipeline per server, so the response does not wait
+for them. A session saved again before its previous save was written is
+written once, with its latest value, and this process reads pending values
+instead of the stored ones.
+
+A queued save is lost if the process dies before it is written, about
+``interval`` seconds at most, or if its write fails. Only use it for
+sessions that can afford it.
+"""
+from collections import OrderedDict
+import atexit
+import logging
+import os
+import threading
+import time
+
+import redis
+
+from redis_sessions import settings
+
+logger = logging.getLogger('redis_sessions')
+
+
+class WriteBehindQueue(object):
+    """
+    Pending writes, by stored key. When the queue holds ``max_size`` keys,
+    ``when_full`` decides: ``'sync'`` hands the write back to the caller,
+    ``'block'`` waits up to ``block_timeout`` seconds for room first.
+    """
+    def __init__(self, max_size=10000, batch_size=500, interval=0.005, when_full='sync',
+                 block_timeout=1.0, flush_on_exit=True):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.interval = interval
+        self.when_full = when_full
+        self.block_timeout = block_timeout
+        self.flush_on_exit = flush_on_exit
+        self._pending = OrderedDict()
+        # the batch being written, still visible to get().
+        self._flushing = {}
+        # keys of that batch deleted meanwhile, deleted again once it is written.
+        self._discarded = set()
+        self._changed = threading.Condition()
+        # batches are written one at a time, in order.
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self.pid = os.getpid()
+
+    def put(self, key, client, data, ttl, index=None, version=None):
+        """
+        Queues the write of ``data`` to ``key`` with ``client``, expiring in
+        ``ttl`` seconds, of ``index``, a ``(index_key, session_key,
+        index_ttl)`` user index entry, and of ``version``, a ``(version_key,
+        version)`` near-cache version written after ``data``. Returns False
+        when the queue is full: the caller writes it itself. Keys of the
+        batch being written are always queued, or that batch could overwrite
+        the caller's write.
+        """
+        with self._changed:
+            if key not in self._pending and key not in self._flushing and not self._wait_for_room():
+                return False
+            # a pending write of the key is replaced in place.
+            self._pending[key] = (client, data, ttl, index, version)
+            self._start()
+            self._changed.notify_all()
+        return True
+
+    def _wait_for_room(self):
+        if len(self._pending) < self.max_size:
+            return True
+        if self.when_full != 'block':
+            return False
+        deadline = time.time() + self.block_timeout
+        while len(self._pending) >= self.max_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            self._changed.wait(remaining)
+        return True
+
+    def get(self, key):
+        """Returns the pending value of ``key``, or None."""
+        with self._changed:
+            write = self._pending.get(key)
+            if write is None and key not in self._discarded:
+                write = self._flushing.get(key)
+        return write[1] if write is not None else None
+
+    def discard(self, key):
+        """
+        Drops the pending write of ``key``, without waiting for the batch
+        being written: if it holds ``key``, ``key`` is deleted again after it.
+        """
+        with self._changed:
+            self._pending.pop(key, None)
+            if key in self._flushing:
+                self._discarded.add(key)
+            self._changed.notify_all()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def flush(self):
+        """Writes all the pending values now."""
+        while self._pending:
+            self._write_batch()
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='redis-sessions-write-behind')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._changed:
+                while not self._pending:
+                    self._changed.wait()
+            # let saves of the same keys coalesce.
+            time.sleep(self.interval)
+            self._write_batch()
+
+    def _write_batch(self):
+        with self._write_lock:
+            with self._changed:
+                while self._pending and len(self._flushing) < self.batch_size:
+                    key, write = self._pending.popitem(last=False)
+                    self._flushing[key] = write
+                self._changed.notify_all()
+            try:
+                pipes = {}
+                for key, (client, data, ttl, index, version) in self._flushing.items():
+                    pipe = pipes.get(id(client))
+                    if pipe is None:
+                        pipe = pipes[id(client)] = client.pipeline(transaction=False)
+                    pipe.setex(key, ttl, data)
+                    if version is not None:
+                        pipe.set(version[0], version[1], ex=ttl)
+                    if index is not None:
+                        index_key, session_key, index_ttl = index
+                        pipe.sadd(index_key, session_key)
+                        pipe.expire(index_key, index_ttl)
+                for pipe in pipes.values():
+                    pipe.execute()
+            except redis.RedisError as e:
+                logger.warning("Could not write %d sessions behind: %s", len(self._flushing), e)
+            finally:
+                with self._changed:
+                    flushed, self._flushing = self._flushing, {}
+                    discarded, self._discarded = self._discarded, set()
+            if discarded:
+                self._delete(flushed, discarded)
+
+    def _delete(self, flushed, keys):
+        """Deletes the ``keys`` of the ``flushed`` batch, and their user index entries."""
+        try:
+            pipes = {}
+            for key in keys:
+                client, _, _, index, _ = flushed[key]
+                pipe = pipes.get(id(client))
+                if pipe is None:
+                    pipe = pipes[id(client)] = client.pipeline(transaction=False)
+                pipe.delete(key)
+                if index is not None:
+                    pipe.srem(index[0], index[1])
+            for pipe in pipes.values():
+                pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Could not delete %d sessions written behind: %s", len(keys), e)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_write_behind():
+    """Returns the write-behind queue of this process, or None if it is disabled."""
+    global _queue
+    if settings.SESSION_REDIS_WRITE_BEHIND is None:
+        return None
+    if _queue is None or _queue.pid != os.getpid():
+        with _queue_lock:
+            # a forked child starts with its own, empty queue.
+            if _queue is None or _queue.pid != os.getpid():
+                options = dict(settings.SESSION_REDIS_WRITE_BEHIND)
+                options.pop('default', None)
+                _queue = WriteBehindQueue(**options)
+                if _queue.flush_on_exit:
+                    atexit.register(_queue.flush)
+    return _queue
@@ -5,7 +5,11 @@ from redis_sessions import __version__
 def read(filename):
     return open(os.path.join(os.path.dirname(__file__), filename)).read()
 
-packages = ['redis_sessions']
+packages = [
+    'redis_sessions',
+    'redis_sessions.management',
+    'redis_sessions.management.commands',
+]
 
 
 setup(
@@ -20,7 +24,11 @@ setup(
     license='BSD',
     packages=packages,
     zip_safe=False,
-    install_requires=['redis>=2.4.10'],
+    install_requires=['redis>=4.2'],
+    extras_require={
+        'msgpack': ['msgpack>=1.0'],
+        'orjson': ['orjson>=3.0'],
+    },
     include_package_data=True,
     classifiers=[
         "Programming Language :: Python :: 2",
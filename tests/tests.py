@@ -1,22 +1,49 @@
 import time
+import redis
 from random import randint
 from nose.tools import eq_, assert_false
 from redis_sessions.session import SessionStore as RedisSessionStore
-from redis_sessions.session import RedisServer
+from redis_sessions.session import RedisServer, HashRing
+from redis_sessions.compressors import ZlibCompressor, train_dictionary
+from redis_sessions.near_cache import NearCache
+from redis_sessions.breaker import CircuitBreaker, CircuitOpenError, null_breaker
+from redis_sessions import serializers
+from redis_sessions import metrics
 from redis_sessions import settings
+from redis_sessions import settings as session_settings
 from django.conf import settings
 # from django.contrib.sessions.tests import SessionTestsMixin
 import base64
-from datetime import timedelta
+from datetime import datetime, timedelta
 from django.conf import settings
-from django.contrib.sessions.backends.base import UpdateError
+from django.contrib.sessions.backends.base import CreateError, SessionBase, UpdateError
 from django.core import management
 from django.test import (
     TestCase, override_settings,
 )
 from django.utils import timezone
-from django.test.utils import override_script_prefix, patch_logger
-from unittest import skip
+from django.test.utils import override_script_prefix
+try:
+    from django.test.utils import patch_logger
+except ImportError:  # Django >= 3.0
+    from contextlib import contextmanager
+    import logging
+
+    @contextmanager
+    def patch_logger(logger_name, log_level):
+        # the helper of older Django versions, recording the messages logged.
+        calls = []
+        logger = logging.getLogger(logger_name)
+        orig = getattr(logger, log_level)
+
+        def replacement(msg, *args, **kwargs):
+            calls.append(msg % args)
+        setattr(logger, log_level, replacement)
+        try:
+            yield calls
+        finally:
+            setattr(logger, log_level, orig)
+from unittest import skip, skipUnless
 import pickle as pypickle
 import six
 
@@ -501,4 +528,1134 @@ class RedisDBTestCase(SessionTestsMixin, TestCase):
         time.sleep(2)
         self.assertFalse(sesssion.exists(key))
 
+    def test_save_must_create_existing_key(self):
+        session = RedisSessionStore()
+        session['key'] = 'value'
+        session.save()
+
+        duplicate = RedisSessionStore(session.session_key)
+        with self.assertRaises(CreateError):
+            duplicate.save(must_create=True)
+        # the original data was not overwritten.
+        self.assertEqual(RedisSessionStore(session.session_key).load(), {'key': 'value'})
+        session.delete()
+
+    def test_binary_format(self):
+        session_settings.SESSION_REDIS_FORMAT = 'binary'
+        try:
+            data = {'a test key': 'a test value'}
+            encoded = self.session.encode(data)
+            self.assertTrue(encoded.startswith(b'\x00'))
+            self.assertEqual(self.session.decode(encoded), data)
+
+            self.session.update(data)
+            self.session.save()
+            session = RedisSessionStore(self.session.session_key)
+            self.assertEqual(session.load(), data)
+        finally:
+            session_settings.SESSION_REDIS_FORMAT = 'base64'
+
+    def test_binary_format_reads_base64(self):
+        data = {'a test key': 'a test value'}
+        self.session.update(data)
+        self.session.save()
+
+        session_settings.SESSION_REDIS_FORMAT = 'binary'
+        try:
+            session = RedisSessionStore(self.session.session_key)
+            self.assertEqual(session.load(), data)
+            session.save()
+            stored = session.server.get(session.get_real_stored_key(session.session_key))
+            self.assertTrue(stored.startswith(b'\x00'))
+        finally:
+            session_settings.SESSION_REDIS_FORMAT = 'base64'
+
+    def test_binary_format_corrupted(self):
+        session_settings.SESSION_REDIS_FORMAT = 'binary'
+        try:
+            encoded = self.session.encode({'a': 'b'})
+        finally:
+            session_settings.SESSION_REDIS_FORMAT = 'base64'
+        with patch_logger('django.security.SuspiciousSession', 'warning') as cm:
+            self.assertEqual({}, self.session.decode(encoded[:-1] + b'x'))
+        self.assertEqual(len(cm), 1)
+
+    def test_zlib_compression(self):
+        session_settings.SESSION_REDIS_COMPRESSOR = 'redis_sessions.compressors.ZlibCompressor'
+        try:
+            small = {'a': 'b'}
+            encoded = self.session.encode(small)
+            # below the size threshold the payload is stored as is.
+            self.assertEqual(encoded[:3], b'\x00\x01\x00')
+            self.assertEqual(self.session.decode(encoded), small)
+
+            large = {'cart': ['item %d' % i for i in range(500)]}
+            encoded = self.session.encode(large)
+            self.assertEqual(encoded[:3], b'\x00\x01\x01')
+            self.assertEqual(self.session.decode(encoded), large)
+        finally:
+            session_settings.SESSION_REDIS_COMPRESSOR = None
+
+        # compressed values stay readable once compression is turned off.
+        self.assertEqual(self.session.decode(encoded), large)
+
+        first = train_dictionary([('{"cart":["item %d","item %d"]}' % (i, i + 1)).encode() for i in range(20)])
+        second = first + b'"retrained"'
+        session_settings.SESSION_REDIS_COMPRESSOR = 'redis_sessions.compressors.ZlibCompressor'
+        session_settings.SESSION_REDIS_COMPRESSOR_OPTIONS = {'dictionary': first}
+        try:
+            encoded = self.session.encode(large)
+            self.assertEqual(encoded[:3], b'\x00\x01\x02')
+            self.assertEqual(self.session.decode(encoded), large)
+
+            session_settings.SESSION_REDIS_COMPRESSOR_OPTIONS = {'dictionary': second, 'previous_dictionaries': [first]}
+            self.assertEqual(self.session.decode(encoded), large)
+            session_settings.SESSION_REDIS_COMPRESSOR_OPTIONS = {'previous_dictionaries': [first]}
+            self.assertEqual(self.session.decode(encoded), large)
+
+            session_settings.SESSION_REDIS_COMPRESSOR_OPTIONS = {'dictionary': second}
+            with self.assertRaises(ValueError):
+                ZlibCompressor(dictionary=second).decompress(encoded[3:])
+            self.assertEqual(self.session.decode(encoded), {})
+        finally:
+            session_settings.SESSION_REDIS_COMPRESSOR = None
+            session_settings.SESSION_REDIS_COMPRESSOR_OPTIONS = {}
+
+        # written with a dictionary, read after compression is turned off.
+        self.assertEqual(self.session.decode(encoded), {})
+        session_settings.SESSION_REDIS_PREVIOUS_DICTIONARIES = [first]
+        try:
+            self.assertEqual(self.session.decode(encoded), large)
+        finally:
+            session_settings.SESSION_REDIS_PREVIOUS_DICTIONARIES = ()
+
+    def test_zlib_dictionary(self):
+        samples = [
+            ('{"_auth_user_id":"%d","_auth_user_backend":"django.contrib.auth.backends.ModelBackend"}' % i).encode()
+            for i in range(20)
+        ]
+        dictionary = train_dictionary(samples)
+        self.assertIn(b'_auth_user_backend', dictionary)
+
+        compressor = ZlibCompressor(dictionary=dictionary)
+        self.assertEqual(compressor.codec, 2)
+        compressed = compressor.compress(samples[0])
+        self.assertLess(len(compressed), len(ZlibCompressor().compress(samples[0])))
+        self.assertEqual(compressor.decompress(compressed), samples[0])
+
+    def test_near_cache_lru(self):
+        cache = NearCache(max_size=2, ttl=60)
+        cache.set('a', b'1')
+        cache.set('b', b'2')
+        cache.get('a')
+        cache.set('c', b'3')
+        self.assertEqual(cache.get('a'), b'1')
+        self.assertIsNone(cache.get('b'))
+
+        cache = NearCache(max_size=2, ttl=-1)
+        cache.set('a', b'1')
+        self.assertIsNone(cache.get('a'))
+
+    def test_near_cache_hit(self):
+        from redis_sessions import near_cache
+        session_settings.SESSION_REDIS_NEAR_CACHE = {'max_size': 10, 'ttl': 60}
+        near_cache._near_cache = None
+        try:
+            for storage in ('string', 'hash'):
+                session_settings.SESSION_REDIS_STORAGE = storage
+                session = RedisSessionStore()
+                session['cart'] = [1]
+                session.save()
+                key = session.get_real_stored_key(session.session_key)
+                loaded = RedisSessionStore(session.session_key).load()
+                # changes to a loaded session do not reach the cache.
+                loaded['cart'].append(2)
+
+                # a hit only reads the version, not the value.
+                if storage == 'hash':
+                    session.server.hset(key, 'cart', b'garbage')
+                else:
+                    session.server.setex(key, 100, b'garbage')
+                self.assertEqual(RedisSessionStore(session.session_key).load(), {'cart': [1]})
+                session.delete()
+        finally:
+            session_settings.SESSION_REDIS_NEAR_CACHE = None
+            session_settings.SESSION_REDIS_STORAGE = 'string'
+            near_cache._near_cache = None
+
+    def test_near_cache_load(self):
+        session_settings.SESSION_REDIS_NEAR_CACHE = {'max_size': 10, 'ttl': 60, 'verify': False}
+        try:
+            self.session['key'] = 'value'
+            self.session.save()
+            key = self.session.get_real_stored_key(self.session.session_key)
+
+            # served from the cache without going to redis.
+            self.session.server.delete(key)
+            self.assertEqual(RedisSessionStore(self.session.session_key).load(), {'key': 'value'})
+
+            # deletes from this process invalidate the cache.
+            self.session.delete()
+            self.assertEqual(RedisSessionStore(self.session.session_key).load(), {})
+        finally:
+            session_settings.SESSION_REDIS_NEAR_CACHE = None
+
+    def test_near_cache_verify(self):
+        from redis_sessions import near_cache
+        session_settings.SESSION_REDIS_NEAR_CACHE = {'max_size': 10, 'ttl': 60}
+        # the caches of two processes.
+        first, second = NearCache(ttl=60), NearCache(ttl=60)
+        try:
+            for storage in ('string', 'hash'):
+                session_settings.SESSION_REDIS_STORAGE = storage
+                near_cache._near_cache = first
+                session = RedisSessionStore()
+                session.update({'a': 1, 'b': 2})
+                session.save()
+                self.assertEqual(RedisSessionStore(session.session_key).load(), {'a': 1, 'b': 2})
+                key = session.get_real_stored_key(session.session_key)
+                self.assertIsNotNone(first.get(key))
+
+                near_cache._near_cache = second
+                other = RedisSessionStore(session.session_key)
+                other['a'] = 3
+                other.save()
+                near_cache._near_cache = first
+                self.assertEqual(RedisSessionStore(session.session_key).load(), {'a': 3, 'b': 2})
+                self.assertEqual(RedisSessionStore(session.session_key).load(), {'a': 3, 'b': 2})
+
+                near_cache._near_cache = second
+                other.delete()
+                near_cache._near_cache = first
+                self.assertEqual(RedisSessionStore(session.session_key).load(), {})
+                self.assertIsNone(first.get(key))
+        finally:
+            session_settings.SESSION_REDIS_NEAR_CACHE = None
+            session_settings.SESSION_REDIS_STORAGE = 'string'
+            near_cache._near_cache = None
+
+    def test_dirty_tracking_touch_only(self):
+        session_settings.SESSION_REDIS_DIRTY_TRACKING = True
+        try:
+            self.session['key'] = 'value'
+            self.session.save()
+            key = self.session.get_real_stored_key(self.session.session_key)
+            self.session.server.expire(key, 100)
+
+            session = RedisSessionStore(self.session.session_key)
+            session.load()
+            # overwrite the stored value behind the store's back: an
+            # unchanged session only refreshes the expiry.
+            stored = self.session.server.get(key)
+            self.session.server.setex(key, 100, session.encode({'key': 'other value'}))
+            session.save()
+            self.assertEqual(self.session.server.ttl(key), session.get_expiry_age())
+            self.assertNotEqual(self.session.server.get(key), stored)
+
+            session['key'] = 'new value'
+            session.save()
+            self.assertEqual(RedisSessionStore(self.session.session_key).load(), {'key': 'new value'})
+        finally:
+            session_settings.SESSION_REDIS_DIRTY_TRACKING = False
+
+    def test_dirty_tracking_touch_slack(self):
+        session_settings.SESSION_REDIS_DIRTY_TRACKING = True
+        session_settings.SESSION_REDIS_TOUCH_SLACK = 60
+        try:
+            self.session['key'] = 'value'
+            self.session.save()
+            key = self.session.get_real_stored_key(self.session.session_key)
+            self.session.server.expire(key, self.session.get_expiry_age() - 10)
+
+            session = RedisSessionStore(self.session.session_key)
+            session.load()
+            session.save()
+            self.assertEqual(self.session.server.ttl(key), self.session.get_expiry_age() - 10)
+        finally:
+            session_settings.SESSION_REDIS_DIRTY_TRACKING = False
+            session_settings.SESSION_REDIS_TOUCH_SLACK = 0
+
+    def test_hash_storage(self):
+        session_settings.SESSION_REDIS_STORAGE = 'hash'
+        try:
+            self.session.update({'a': 1, 'b': 2})
+            self.session.save()
+            key = self.session.get_real_stored_key(self.session.session_key)
+            self.assertEqual(self.session.server.type(key), b'hash')
+
+            session = RedisSessionStore(self.session.session_key)
+            self.assertEqual(session.load(), {'a': 1, 'b': 2})
+            # a field changed by another request is kept when this one
+            # saves its own changes.
+            self.session.server.hset(key, 'b', session._pack(session.serializer().dumps(3)))
+            session['c'] = 4
+            del session['a']
+            session.save()
+            self.assertEqual(RedisSessionStore(self.session.session_key).load(), {'b': 3, 'c': 4})
+            self.assertEqual(self.session.server.ttl(key), session.get_expiry_age())
+
+            with self.assertRaises(CreateError):
+                RedisSessionStore(self.session.session_key).save(must_create=True)
+        finally:
+            session_settings.SESSION_REDIS_STORAGE = 'string'
+
+    def test_hash_storage_reads_string_storage(self):
+        self.session['a'] = 1
+        self.session.save()
+        session_settings.SESSION_REDIS_STORAGE = 'hash'
+        try:
+            session = RedisSessionStore(self.session.session_key)
+            self.assertEqual(session.load(), {'a': 1})
+            session['b'] = 2
+            session.save()
+            key = self.session.get_real_stored_key(self.session.session_key)
+            self.assertEqual(self.session.server.type(key), b'hash')
+            self.assertEqual(RedisSessionStore(self.session.session_key).load(), {'a': 1, 'b': 2})
+        finally:
+            session_settings.SESSION_REDIS_STORAGE = 'string'
+
+    def test_hash_ring(self):
+        servers = [{'host': 'localhost%d' % i, 'port': 6379} for i in range(4)]
+        keys = ['%032x' % randint(0, 2 ** 128) for _ in range(2000)]
+
+        ring = HashRing(servers)
+        before = [ring.get_server_key(key) for key in keys]
+        self.assertEqual(set(before), set(range(4)))
+        self.assertEqual(before, [HashRing(servers).get_server_key(key) for key in keys])
+
+        # adding a fifth server only moves about a fifth of the keys.
+        ring = HashRing(servers + [{'host': 'localhost4', 'port': 6379}])
+        after = [ring.get_server_key(key) for key in keys]
+        moved = sum(1 for a, b in zip(before, after) if a != b)
+        self.assertLess(moved, len(keys) * 0.3)
+        self.assertTrue(all(b == 4 for a, b in zip(before, after) if a != b))
+
+    def test_redis_pool_ring_router(self):
+        session_settings.SESSION_REDIS_POOL_ROUTER = 'ring'
+        try:
+            servers = [{'host': 'localhost1', 'weight': 3}, {'host': 'localhost2', 'weight': 1}]
+            rs = RedisServer('')
+            server_keys = [rs.get_server('%032x' % randint(0, 2 ** 128), servers)[0] for _ in range(2000)]
+            self.assertGreater(server_keys.count(0), server_keys.count(1) * 2)
+        finally:
+            session_settings.SESSION_REDIS_POOL_ROUTER = 'modulo'
+
+    def test_redis_pool_routing(self):
+        session_settings.SESSION_REDIS_POOL = [
+            {'host': 'localhost1', 'port': 6379, 'db': 1},
+            {'host': 'localhost2', 'port': 6380, 'db': 2},
+        ]
+        RedisServer.reset()
+        try:
+            rs = RedisServer('m8f0os91g40fsq8eul6tejqpp6k22')
+            self.assertEqual(rs.connection_key, '1redis_host')
+            self.assertEqual(rs.config.options['host'], 'localhost2')
+            self.assertEqual(rs.config.options['port'], 6380)
+
+            rs = RedisServer('jgpsbmjj6030fdr3aefg37nq47nb8')
+            self.assertEqual(rs.connection_key, '0redis_host')
+            self.assertEqual(rs.config.options['db'], 1)
+            # the settings are left untouched.
+            self.assertEqual(session_settings.SESSION_REDIS_HOST, settings.SESSION_REDIS['host'])
+        finally:
+            session_settings.SESSION_REDIS_POOL = None
+            RedisServer.reset()
+
+    @skipUnless(hasattr(SessionBase, 'aload'), 'async sessions require Django >= 5.0')
+    def test_async_session_store(self):
+        from asgiref.sync import async_to_sync
+        from redis_sessions.async_session import SessionStore as AsyncSessionStore
+
+        async def run():
+            session = AsyncSessionStore()
+            await session.aset('key', 'value')
+            await session.asave()
+            session_key = session.session_key
+            # same keyspace as the sync store.
+            self.assertEqual(RedisSessionStore(session_key).load(), {'key': 'value'})
+            self.assertEqual(await AsyncSessionStore(session_key).aload(), {'key': 'value'})
+
+            await session.acycle_key()
+            self.assertNotEqual(session.session_key, session_key)
+            self.assertFalse(await session.aexists(session_key))
+            self.assertEqual(await AsyncSessionStore(session.session_key).aget('key'), 'value')
+
+            await session.adelete()
+            self.assertFalse(await session.aexists(session.session_key))
+
+        async_to_sync(run)()
+
+    @skipUnless(hasattr(SessionBase, 'aload'), 'async sessions require Django >= 5.0')
+    def test_async_client_per_loop(self):
+        import asyncio
+        from redis_sessions.async_session import SessionStore as AsyncSessionStore
+        # built outside of any event loop, as by the middleware.
+        session = AsyncSessionStore()
+        clients = []
+
+        async def run():
+            clients.append(session.async_server)
+            self.assertIs(session.async_server, clients[-1])
+            await session.aset('key', 'value')
+            await session.asave()
+            self.assertEqual(await AsyncSessionStore(session.session_key).aload(), {'key': 'value'})
+
+        # each asyncio.run() closes its loop, and the clients bound to it.
+        asyncio.run(run())
+        asyncio.run(run())
+        self.assertIsNot(clients[0], clients[1])
+
+    @skipUnless(hasattr(SessionBase, 'aload'), 'async sessions require Django >= 5.0')
+    def test_async_load_cancelled(self):
+        import asyncio
+        from redis_sessions.async_session import SessionStore as AsyncSessionStore
+        session = AsyncSessionStore()
+
+        async def cancelled(key):
+            raise asyncio.CancelledError()
+
+        session._afetch = cancelled
+        # a cancelled request is not an empty session.
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(session.aload())
+
+    def test_async_fetch(self):
+        import asyncio
+        from redis_sessions.async_session import SessionStore as AsyncSessionStore
+        host = settings.SESSION_REDIS['host']
+        session_settings.SESSION_REDIS_POOL = [{'host': host, 'db': 0}]
+        # async clients are bound to the event loop that created them.
+        RedisServer.reset()
+        try:
+            self.session['key'] = 'value'
+            self.session.save()
+            moved = None
+            while moved is None:
+                session = RedisSessionStore()
+                session['key'] = 'moved'
+                session.set_expiry(600)
+                session.save()
+                if RedisServer(session.session_key).get_server(session.session_key, [{}, {}])[0] == 1:
+                    moved = session.session_key
+                else:
+                    session.delete()
+            previous = RedisServer(None).get()
+
+            async def fetch(session_key):
+                session = AsyncSessionStore(session_key)
+                stored = (await session._afetch(session.get_real_stored_key(session_key)))[0]
+                return session._stored_session(stored)
+
+            async def run():
+                self.assertEqual(await fetch(self.session.session_key), {'key': 'value'})
+                self.assertEqual(await fetch(RedisSessionStore()._get_new_session_key()), {})
+                # moved from its previous server, with its expiry.
+                self.assertEqual((await fetch(moved))['key'], 'moved')
+                session = AsyncSessionStore(moved)
+                key = session.get_real_stored_key(moved)
+                self.assertFalse(previous.exists(key))
+                self.assertGreater(await session.async_server.ttl(key), 500)
+                self.assertFalse(await session._amigrate(key))
+                await session.adelete()
+                self.assertFalse(await session.async_server.exists(key))
+
+            session_settings.SESSION_REDIS_PREVIOUS_POOL = session_settings.SESSION_REDIS_POOL
+            session_settings.SESSION_REDIS_POOL = [{'host': host, 'db': 0}, {'host': host, 'db': 1}]
+            RedisServer.reset()
+            asyncio.run(run())
+        finally:
+            session_settings.SESSION_REDIS_POOL = None
+            session_settings.SESSION_REDIS_PREVIOUS_POOL = None
+            RedisServer.reset()
+
+    @skipUnless(hasattr(SessionBase, 'aload'), 'async sessions require Django >= 5.0')
+    def test_async_save(self):
+        import asyncio
+        from redis_sessions.async_session import SessionStore as AsyncSessionStore
+
+        async def run():
+            for storage in ('string', 'hash'):
+                session_settings.SESSION_REDIS_STORAGE = storage
+                session = AsyncSessionStore()
+                session['a'] = 1
+                await session._asave(must_create=True)
+                self.assertEqual(RedisSessionStore(session.session_key).load(), {'a': 1})
+                with self.assertRaises(CreateError):
+                    await AsyncSessionStore(session.session_key)._asave(must_create=True)
+                session['b'] = 2
+                await session._asave(must_create=False)
+                self.assertEqual(RedisSessionStore(session.session_key).load(), {'a': 1, 'b': 2})
+                await session.adelete()
+            session_settings.SESSION_REDIS_STORAGE = 'string'
+
+            session_settings.SESSION_REDIS_VERSIONED = True
+            session = AsyncSessionStore()
+            session.update({'a': 1, 'b': 1})
+            await session._asave(must_create=True)
+            first, second = AsyncSessionStore(session.session_key), AsyncSessionStore(session.session_key)
+            await first._aget_session()
+            await second._aget_session()
+            first['a'] = 2
+            second['b'] = 2
+            await first._asave(must_create=False)
+            # merged into the session saved by `first`.
+            await second._asave(must_create=False)
+            self.assertEqual(RedisSessionStore(session.session_key).load(), {'a': 2, 'b': 2})
+            await session.adelete()
+
+        RedisServer.reset()
+        try:
+            asyncio.run(run())
+        finally:
+            session_settings.SESSION_REDIS_STORAGE = 'string'
+            session_settings.SESSION_REDIS_VERSIONED = False
+            RedisServer.reset()
+
+    def test_bulk_operations(self):
+        session_keys = []
+        for i in range(5):
+            session = RedisSessionStore()
+            session['i'] = i
+            session.save()
+            session_keys.append(session.session_key)
+        missing_key = RedisSessionStore()._get_new_session_key()
+
+        sessions = RedisSessionStore.load_many(session_keys + [missing_key], chunk_size=2)
+        self.assertEqual(sessions, dict((key, {'i': i}) for i, key in enumerate(session_keys)))
+
+        exists = RedisSessionStore.exists_many(session_keys + [missing_key])
+        self.assertTrue(all(exists[key] for key in session_keys))
+        self.assertFalse(exists[missing_key])
+
+        self.assertEqual(RedisSessionStore.delete_many(session_keys + [missing_key], chunk_size=2), 5)
+        self.assertEqual(RedisSessionStore.load_many(session_keys), {})
+
+    def test_clear_expired(self):
+        self.session['key'] = 'value'
+        self.session.save()
+        server = self.session.server
+        key = self.session.get_real_stored_key('no-expiry-key')
+        server.set(key, self.session.encode({'key': 'value'}))
+
+        RedisSessionStore.clear_expired()
+        self.assertFalse(server.exists(key))
+        self.assertTrue(self.session.exists(self.session.session_key))
+
+        # sweeps at most sweep_rate keys per second.
+        for i in range(5):
+            server.set(self.session.get_real_stored_key('no-expiry-key-%d' % i), b'x')
+        session_settings.SESSION_REDIS_SWEEP_RATE = 50
+        try:
+            started = time.time()
+            RedisSessionStore.clear_expired()
+            self.assertGreaterEqual(time.time() - started, 0.1)
+        finally:
+            session_settings.SESSION_REDIS_SWEEP_RATE = 5000
+
+    def test_sweepsessions_command(self):
+        server = self.session.server
+        bad_key = self.session.get_real_stored_key('undecodable-key')
+        server.setex(bad_key, 60, b'garbage')
+
+        management.call_command('sweepsessions', undecodable=True, dry_run=True)
+        self.assertTrue(server.exists(bad_key))
+        management.call_command('sweepsessions', undecodable=True, batch_size=2)
+        self.assertFalse(server.exists(bad_key))
+
+    def test_delete_user_sessions(self):
+        session_settings.SESSION_REDIS_USER_INDEX = True
+        try:
+            user_sessions = []
+            for i in range(3):
+                session = RedisSessionStore()
+                session['_auth_user_id'] = '42'
+                session.save()
+                user_sessions.append(session.session_key)
+            other = RedisSessionStore()
+            other['_auth_user_id'] = '43'
+            other.save()
+            # expired, still indexed.
+            server = other.server
+            server.delete(other.get_real_stored_key(user_sessions[0]))
+
+            self.assertEqual(RedisSessionStore.delete_user_sessions(42), 2)
+            self.assertFalse(any(RedisSessionStore.exists_many(user_sessions).values()))
+            self.assertTrue(other.exists(other.session_key))
+            index_key = other.get_real_stored_key('user:42')
+            self.assertEqual(server.smembers(index_key), set([user_sessions[0].encode()]))
+            server.delete(index_key)
+            other.delete()
+        finally:
+            session_settings.SESSION_REDIS_USER_INDEX = False
+
+    def test_user_index_cleanup(self):
+        session_settings.SESSION_REDIS_USER_INDEX = True
+        try:
+            sessions = []
+            for i in range(4):
+                session = RedisSessionStore()
+                session['_auth_user_id'] = '42'
+                session.save()
+                sessions.append(session)
+            server = sessions[0].server
+            index_key = sessions[0].get_real_stored_key('user:42')
+
+            sessions[0].delete()
+            RedisSessionStore().delete(sessions[1].session_key)
+            RedisSessionStore.delete_many([sessions[2].session_key])
+            self.assertEqual(server.smembers(index_key), set([sessions[3].session_key.encode()]))
+
+            # expired, and pruned on the next login.
+            server.delete(sessions[3].get_real_stored_key(sessions[3].session_key))
+            session = RedisSessionStore()
+            session['_auth_user_id'] = '42'
+            session.cycle_key()
+            self.assertEqual(server.smembers(index_key), set([session.session_key.encode()]))
+            session.delete()
+            self.assertFalse(server.exists(index_key))
+        finally:
+            session_settings.SESSION_REDIS_USER_INDEX = False
+
+    def test_prometheus_metrics(self):
+        session_settings.SESSION_REDIS_METRICS = 'redis_sessions.metrics.PrometheusSink'
+        metrics._sink = None
+        try:
+            self.session['key'] = 'value'
+            self.session.save()
+            RedisSessionStore(self.session.session_key).load()
+            RedisSessionStore('missingsessionkey').load()
+
+            output = metrics.get_sink().render()
+            labels = 'connection_key="%s"' % self.session.connection_key
+            self.assertIn('redis_sessions_load_total{%s,result="hit"} 1.0' % labels, output)
+            self.assertIn('redis_sessions_load_total{%s,result="miss"} 1.0' % labels, output)
+            self.assertIn('redis_sessions_operation_seconds_count{%s,operation="save"} 1' % labels, output)
+            self.assertIn('# TYPE redis_sessions_payload_bytes histogram', output)
+            self.assertEqual(metrics.metrics_view(None).content.decode(), output)
+        finally:
+            session_settings.SESSION_REDIS_METRICS = None
+            metrics._sink = None
+
+    def test_metrics_view_without_render(self):
+        from django.http import Http404
+        metrics._sink = None
+        # the default sink has nothing to serve.
+        with self.assertRaises(Http404):
+            metrics.metrics_view(None)
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(threshold=2, cooldown=0.1)
+        for i in range(2):
+            with self.assertRaises(redis.TimeoutError):
+                with breaker:
+                    raise redis.TimeoutError
+        with self.assertRaises(CircuitOpenError):
+            with breaker:
+                pass
+        time.sleep(0.1)
+        # a single probe is let through after the cooldown.
+        with breaker:
+            with self.assertRaises(CircuitOpenError):
+                with breaker:
+                    pass
+        with breaker:
+            pass
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_server_routed_once(self):
+        self.session['key'] = 'value'
+        self.session.save()
+        routed = self.session._route()
+        self.assertIs(self.session.guard(self.session.session_key), null_breaker)
+        self.session.load()
+        self.session.save()
+        self.assertEqual(self.session.connection_key, routed.connection_key)
+        self.assertIs(self.session._route(), routed)
+        # routed again for another session key.
+        self.session.cycle_key()
+        self.assertIsNot(self.session._route(), routed)
+        self.assertEqual(self.session._route().session_key, self.session.session_key)
+
+    def test_fallback_when_circuit_open(self):
+        session_settings.SESSION_REDIS_BREAKER_THRESHOLD = 1
+        session_settings.SESSION_REDIS_BREAKER_COOLDOWN = 60
+        session_settings.SESSION_REDIS_FALLBACK = 'django.contrib.sessions.backends.signed_cookies'
+        RedisServer.reset()
+        try:
+            breaker = RedisServer(None).guard()
+            breaker.failure()
+
+            session = RedisSessionStore()
+            session['key'] = 'value'
+            session.save()
+            # stored in the cookie while the server is skipped.
+            self.assertEqual(RedisSessionStore(session.session_key)['key'], 'value')
+
+            breaker.success()
+            recovered = RedisSessionStore(session.session_key)
+            self.assertEqual(recovered['key'], 'value')
+            self.assertTrue(recovered.modified)
+        finally:
+            session_settings.SESSION_REDIS_BREAKER_THRESHOLD = 0
+            session_settings.SESSION_REDIS_FALLBACK = None
+            RedisServer.reset()
+
+    def test_connection_pool_options(self):
+        session_settings.SESSION_REDIS_MAX_CONNECTIONS = 8
+        session_settings.SESSION_REDIS_POOL = [
+            {'host': 'localhost1'},
+            {'host': 'localhost2', 'blocking_pool': True, 'max_connections': 2},
+        ]
+        RedisServer.reset()
+        try:
+            pools = [client.connection_pool for _, client in RedisServer.get_all()]
+            self.assertEqual([pool.max_connections for pool in pools], [8, 2])
+            self.assertIsInstance(pools[1], redis.BlockingConnectionPool)
+        finally:
+            session_settings.SESSION_REDIS_MAX_CONNECTIONS = None
+            session_settings.SESSION_REDIS_POOL = None
+            RedisServer.reset()
+
+    def test_prewarm(self):
+        RedisServer.reset()
+        self.assertEqual(RedisServer.prewarm(3), 0)
+        pool = RedisServer(None).get().connection_pool
+        self.assertEqual(len(pool._available_connections), 3)
+
+    def test_hash_tags(self):
+        session_settings.SESSION_REDIS_HASH_TAGS = True
+        try:
+            key = self.session.get_real_stored_key('abc')
+            self.assertTrue(key.endswith('{abc}'))
+            self.assertEqual(self.session.get_session_key(key), 'abc')
+
+            self.session['key'] = 'value'
+            self.session.save()
+            self.assertTrue(self.session.server.exists(self.session.get_real_stored_key(self.session.session_key)))
+            self.assertEqual(RedisSessionStore(self.session.session_key)['key'], 'value')
+        finally:
+            session_settings.SESSION_REDIS_HASH_TAGS = False
+
+    def test_cluster_routing(self):
+        session_settings.SESSION_REDIS_CLUSTER = [{'host': 'node1', 'port': 7000}]
+        RedisServer.reset()
+        try:
+            rs = RedisServer('m8f0os91g40fsq8eul6tejqpp6k22')
+            self.assertEqual(rs.connection_type, 'cluster')
+            self.assertEqual(rs.config.options['startup_nodes'], [{'host': 'node1', 'port': 7000}])
+        finally:
+            session_settings.SESSION_REDIS_CLUSTER = None
+            RedisServer.reset()
+
+    def test_read_from_replicas(self):
+        session_settings.SESSION_REDIS_READ_FROM_REPLICAS = True
+        session_settings.SESSION_REDIS_READ_YOUR_WRITES = 60
+        session_settings.SESSION_REDIS_POOL = [
+            {'host': 'localhost1', 'db': 1, 'replicas': [{'host': 'localhost2'}]},
+        ]
+        RedisServer.reset()
+        try:
+            rs = RedisServer('m8f0os91g40fsq8eul6tejqpp6k22')
+            replica = rs.replica_config()
+            self.assertEqual(replica.options['host'], 'localhost2')
+            # the replica reads the database of its master.
+            self.assertEqual(replica.options['db'], 1)
+
+            session = RedisSessionStore('m8f0os91g40fsq8eul6tejqpp6k22')
+            key = session.get_real_stored_key(session.session_key)
+            session._written(key)
+            # just written: read from the master.
+            self.assertIs(session._read_client(key), rs.get())
+        finally:
+            session_settings.SESSION_REDIS_READ_FROM_REPLICAS = False
+            session_settings.SESSION_REDIS_READ_YOUR_WRITES = 5
+            session_settings.SESSION_REDIS_POOL = None
+            RedisServer.reset()
+
+    @override_settings(SESSION_ENGINE='redis_sessions.session')
+    def test_read_your_writes_cookie(self):
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from redis_sessions.middleware import SessionMiddleware
+        from redis_sessions.near_cache import get_recent_writes
+        cookie_name = session_settings.SESSION_REDIS_READ_YOUR_WRITES_COOKIE
+        session_settings.SESSION_REDIS_READ_FROM_REPLICAS = True
+        session_settings.SESSION_REDIS_REPLICAS = [{'host': settings.SESSION_REDIS['host']}]
+        RedisServer.reset()
+        try:
+            def login(request):
+                request.session['_auth_user_id'] = '42'
+                return HttpResponse()
+            response = SessionMiddleware(login)(RequestFactory().get('/'))
+            self.assertEqual(response.cookies[cookie_name]['max-age'], session_settings.SESSION_REDIS_READ_YOUR_WRITES)
+            session_key = response.cookies[settings.SESSION_COOKIE_NAME].value
+
+            # another worker, which did not write the session.
+            get_recent_writes().clear()
+
+            def view(request):
+                key = request.session.get_real_stored_key(session_key)
+                self.assertTrue(request.session.written_recently)
+                self.assertIs(request.session._read_client(key), RedisServer(session_key).get())
+                self.assertEqual(request.session['_auth_user_id'], '42')
+                return HttpResponse()
+            request = RequestFactory().get('/')
+            request.COOKIES[settings.SESSION_COOKIE_NAME] = session_key
+            request.COOKIES[cookie_name] = '1'
+            response = SessionMiddleware(view)(request)
+            # only read: the window is not extended.
+            self.assertNotIn(cookie_name, response.cookies)
+            RedisSessionStore().delete(session_key)
+        finally:
+            session_settings.SESSION_REDIS_READ_FROM_REPLICAS = False
+            session_settings.SESSION_REDIS_REPLICAS = None
+            RedisServer.reset()
+
+    @skipUnless(serializers.msgpack and serializers.orjson, 'requires msgpack and orjson')
+    def test_compact_serializers(self):
+        from decimal import Decimal
+        from django.contrib.sessions.serializers import JSONSerializer
+        session = {
+            'when': datetime(2018, 1, 2, 3, 4, 5), 'day': datetime(2018, 1, 2).date(),
+            'price': Decimal('1.10'), 'items': [1, 'a', None],
+        }
+        legacy = JSONSerializer().dumps({'key': 'value'})
+        for serializer in (serializers.MsgpackSerializer(), serializers.OrjsonSerializer()):
+            self.assertEqual(serializer.loads(serializer.dumps(session)), session)
+            # sessions of the previous serializer stay readable.
+            self.assertEqual(serializer.loads(legacy), {'key': 'value'})
+
+    def test_buffer_decoding(self):
+        payload = b'{"a": "b"}'
+        self.assertEqual(self.session._hmac(memoryview(payload)), self.session._hash(payload).encode())
+
+        with override_settings(SESSION_SERIALIZER='redis_sessions.serializers.OrjsonSerializer'):
+            session = RedisSessionStore()
+        try:
+            for format in ('base64', 'binary'):
+                session_settings.SESSION_REDIS_FORMAT = format
+                encoded = session.encode({'a': datetime(2018, 1, 2)})
+                self.assertIsInstance(session._unpack(encoded), memoryview)
+                self.assertEqual(session.decode(encoded), {'a': datetime(2018, 1, 2)})
+                with patch_logger('django.security.SuspiciousSession', 'warning'):
+                    self.assertEqual(session.decode(encoded[:-2] + b'xx'), {})
+        finally:
+            session_settings.SESSION_REDIS_FORMAT = 'base64'
 
+    def test_rebalance_pool(self):
+        host = settings.SESSION_REDIS['host']
+        session_settings.SESSION_REDIS_POOL = [{'host': host, 'db': 0}]
+        RedisServer.reset()
+        try:
+            moved = []
+            while len(moved) < 2:
+                session = RedisSessionStore()
+                session['key'] = 'value'
+                session.set_expiry(600)
+                session.save()
+                if RedisServer(session.session_key).get_server(session.session_key, [{}, {}])[0] == 1:
+                    moved.append(session.session_key)
+            previous = RedisServer(None).get()
+
+            session_settings.SESSION_REDIS_PREVIOUS_POOL = session_settings.SESSION_REDIS_POOL
+            session_settings.SESSION_REDIS_POOL = [{'host': host, 'db': 0}, {'host': host, 'db': 1}]
+            RedisServer.reset()
+            # moved on load, with its expiry.
+            session = RedisSessionStore(moved[0])
+            self.assertEqual(session.load()['key'], 'value')
+            key = session.get_real_stored_key(moved[0])
+            self.assertFalse(previous.exists(key))
+            self.assertGreater(session.server.ttl(key), 500)
+
+            key = session.get_real_stored_key(moved[1])
+            management.call_command('rebalancesessions', dry_run=True)
+            self.assertTrue(previous.exists(key))
+            management.call_command('rebalancesessions')
+            self.assertFalse(previous.exists(key))
+            self.assertTrue(RedisSessionStore(moved[1]).exists(moved[1]))
+            RedisSessionStore.delete_many(moved)
+        finally:
+            session_settings.SESSION_REDIS_POOL = None
+            session_settings.SESSION_REDIS_PREVIOUS_POOL = None
+            RedisServer.reset()
+
+    def test_previous_pool_deletes(self):
+        host = settings.SESSION_REDIS['host']
+        session_settings.SESSION_REDIS_POOL = [{'host': host, 'db': 0}]
+        session_settings.SESSION_REDIS_USER_INDEX = True
+        RedisServer.reset()
+        try:
+            moved = []
+            while len(moved) < 2:
+                session = RedisSessionStore()
+                session.create()
+                if RedisServer(session.session_key).get_server(session.session_key, [{}, {}])[0] == 1:
+                    session['_auth_user_id'] = '42'
+                    session.save()
+                    moved.append(session.session_key)
+                else:
+                    session.delete()
+            previous = RedisServer(None).get()
+            index_key = session.get_real_stored_key('user:42')
+            previous.srem(index_key, moved[0])
+
+            session_settings.SESSION_REDIS_PREVIOUS_POOL = session_settings.SESSION_REDIS_POOL
+            session_settings.SESSION_REDIS_POOL = [{'host': host, 'db': 0}, {'host': host, 'db': 1}]
+            RedisServer.reset()
+            self.assertEqual(RedisSessionStore.delete_many([moved[0]]), 1)
+            self.assertFalse(previous.exists(session.get_real_stored_key(moved[0])))
+            self.assertEqual(RedisSessionStore.delete_user_sessions(42), 1)
+            self.assertFalse(previous.exists(session.get_real_stored_key(moved[1])))
+            self.assertFalse(previous.exists(index_key))
+
+            # user indexes are not sessions to move.
+            previous.sadd(index_key, moved[0])
+            management.call_command('rebalancesessions')
+            self.assertTrue(previous.exists(index_key))
+            self.assertFalse(RedisServer(moved[0]).get().exists(index_key))
+            previous.delete(index_key)
+        finally:
+            session_settings.SESSION_REDIS_POOL = None
+            session_settings.SESSION_REDIS_PREVIOUS_POOL = None
+            session_settings.SESSION_REDIS_USER_INDEX = False
+            RedisServer.reset()
+
+    def test_rebalance_user_index(self):
+        host = settings.SESSION_REDIS['host']
+        session_settings.SESSION_REDIS_POOL = [{'host': host, 'db': 0}]
+        session_settings.SESSION_REDIS_USER_INDEX = True
+        RedisServer.reset()
+        try:
+            sessions, moved = [], []
+            while len(moved) < 3:
+                session = RedisSessionStore()
+                session['_auth_user_id'] = '42'
+                session.save()
+                sessions.append(session.session_key)
+                if RedisServer(session.session_key).get_server(session.session_key, [{}, {}])[0] == 1:
+                    moved.append(session.session_key)
+            index_key = session.get_real_stored_key('user:42')
+            previous = RedisServer(None).get()
+
+            session_settings.SESSION_REDIS_PREVIOUS_POOL = session_settings.SESSION_REDIS_POOL
+            session_settings.SESSION_REDIS_POOL = [{'host': host, 'db': 0}, {'host': host, 'db': 1}]
+            RedisServer.reset()
+            # moved on load, and by the command.
+            self.assertEqual(RedisSessionStore(moved[0]).load(), {'_auth_user_id': '42'})
+            management.call_command('rebalancesessions')
+            target = RedisServer(moved[0]).get()
+            self.assertEqual(target.smembers(index_key), set(key.encode() for key in moved))
+            self.assertGreater(target.ttl(index_key), 0)
+            self.assertFalse(previous.smembers(index_key) & target.smembers(index_key))
+
+            session_settings.SESSION_REDIS_PREVIOUS_POOL = None
+            RedisServer.reset()
+            self.assertEqual(RedisSessionStore.delete_user_sessions(42), len(sessions))
+            self.assertFalse(any(RedisSessionStore.exists_many(sessions).values()))
+        finally:
+            session_settings.SESSION_REDIS_POOL = None
+            session_settings.SESSION_REDIS_PREVIOUS_POOL = None
+            session_settings.SESSION_REDIS_USER_INDEX = False
+            RedisServer.reset()
+
+    def test_migrate_from_db(self):
+        from django.contrib.sessions.backends.db import SessionStore as DatabaseSession
+        session_settings.SESSION_REDIS_MIGRATE_FROM = 'django.contrib.sessions.backends.db'
+        try:
+            legacy = DatabaseSession()
+            legacy['key'] = 'value'
+            legacy.save()
+            session = RedisSessionStore(legacy.session_key)
+            self.assertEqual(session['key'], 'value')
+            ttl = session.server.ttl(session.get_real_stored_key(legacy.session_key))
+            self.assertTrue(0 < ttl <= settings.SESSION_COOKIE_AGE)
+            # a deleted session is not copied again.
+            session.delete()
+            self.assertFalse(DatabaseSession().exists(legacy.session_key))
+            self.assertEqual(RedisSessionStore(legacy.session_key).load(), {})
+
+            legacy = DatabaseSession()
+            legacy['key'] = 'value'
+            legacy.save()
+            management.call_command('importsessions', delete=True, batch_size=2)
+            self.assertTrue(session.exists(legacy.session_key))
+            self.assertFalse(DatabaseSession().exists(legacy.session_key))
+            session.delete(legacy.session_key)
+
+            # nor after a bulk delete.
+            legacy = DatabaseSession()
+            legacy['key'] = 'value'
+            legacy.save()
+            self.assertEqual(RedisSessionStore(legacy.session_key)['key'], 'value')
+            RedisSessionStore.delete_many([legacy.session_key])
+            self.assertFalse(DatabaseSession().exists(legacy.session_key))
+            self.assertEqual(RedisSessionStore(legacy.session_key).load(), {})
+
+            session_settings.SESSION_REDIS_USER_INDEX = True
+            legacy = DatabaseSession()
+            legacy['_auth_user_id'] = '42'
+            legacy.save()
+            self.assertEqual(RedisSessionStore(legacy.session_key)['_auth_user_id'], '42')
+            self.assertEqual(RedisSessionStore.delete_user_sessions(42), 1)
+            self.assertFalse(DatabaseSession().exists(legacy.session_key))
+            self.assertEqual(RedisSessionStore(legacy.session_key).load(), {})
+        finally:
+            session_settings.SESSION_REDIS_MIGRATE_FROM = None
+            session_settings.SESSION_REDIS_USER_INDEX = False
+
+    def test_versioned_save(self):
+        session_settings.SESSION_REDIS_VERSIONED = True
+        try:
+            self.session.update({'a': 1, 'b': 1})
+            self.session.save()
+            first = RedisSessionStore(self.session.session_key)
+            second = RedisSessionStore(self.session.session_key)
+            first['a'] = 2
+            second['b'] = 2
+            del second['a']
+            first.save()
+            # merged into the session saved by `first`.
+            second.save()
+            self.assertEqual(RedisSessionStore(self.session.session_key).load(), {'b': 2})
+
+            second['c'] = 3
+            second.save()
+            # deleted meanwhile, e.g. by a logout in another request.
+            first.delete()
+            second['d'] = 4
+            self.assertRaises(UpdateError, second.save)
+        finally:
+            session_settings.SESSION_REDIS_VERSIONED = False
+
+    def test_write_behind(self):
+        from redis_sessions import write_behind
+        session_settings.SESSION_REDIS_WRITE_BEHIND = {'interval': 60, 'max_size': 1}
+        write_behind._queue = None
+        try:
+            # new sessions are created synchronously.
+            self.session['key'] = 'value'
+            self.session.save()
+            key = self.session.get_real_stored_key(self.session.session_key)
+            self.session['key'] = 'pending'
+            self.session.save()
+            self.session['key'] = 'latest'
+            self.session.save()
+            queue = write_behind.get_write_behind()
+            self.assertEqual(len(queue), 1)
+            self.assertEqual(self.session.decode(self.session.server.get(key)), {'key': 'value'})
+            self.assertEqual(RedisSessionStore(self.session.session_key)['key'], 'latest')
+
+            # the queue is full: saved synchronously.
+            other = RedisSessionStore()
+            other['key'] = 'value'
+            other.save()
+            other['key'] = 'other'
+            other.save()
+            self.assertEqual(len(queue), 1)
+            self.assertEqual(other.decode(other.server.get(other.get_real_stored_key(other.session_key))), {'key': 'other'})
+
+            queue.flush()
+            self.assertEqual(self.session.decode(self.session.server.get(key)), {'key': 'latest'})
+            other.delete()
+        finally:
+            session_settings.SESSION_REDIS_WRITE_BEHIND = None
+            write_behind._queue = None
+
+    def test_write_behind_in_flight(self):
+        import threading
+        from redis_sessions.write_behind import WriteBehindQueue
+        server = self.session.server
+        started, release = threading.Event(), threading.Event()
+
+        class SlowClient(object):
+            def pipeline(self, transaction=True):
+                pipe = server.pipeline(transaction=transaction)
+                execute = pipe.execute
+
+                def slow_execute(*args, **kwargs):
+                    started.set()
+                    release.wait(5)
+                    return execute(*args, **kwargs)
+                pipe.execute = slow_execute
+                return pipe
+
+        queue = WriteBehindQueue(max_size=1, interval=0)
+        queue._start = lambda: None
+        key = self.session.get_real_stored_key('in-flight')
+        other = self.session.get_real_stored_key('other')
+        try:
+            # deleted while its batch is written: not waiting, deleted again after it.
+            queue.put(key, SlowClient(), b'stale', 60)
+            writer = threading.Thread(target=queue._write_batch)
+            writer.start()
+            self.assertTrue(started.wait(5))
+            queue.discard(key)
+            self.assertFalse(release.is_set())
+            self.assertIsNone(queue.get(key))
+            release.set()
+            writer.join()
+            self.assertFalse(server.exists(key))
+
+            # saved again while its batch is written, with the queue full.
+            started.clear()
+            release.clear()
+            queue.put(key, SlowClient(), b'stale', 60)
+            writer = threading.Thread(target=queue._write_batch)
+            writer.start()
+            self.assertTrue(started.wait(5))
+            self.assertTrue(queue.put(other, server, b'other', 60))
+            self.assertFalse(queue.put(self.session.get_real_stored_key('full'), server, b'full', 60))
+            self.assertTrue(queue.put(key, server, b'fresh', 60))
+            release.set()
+            writer.join()
+            queue.flush()
+            self.assertEqual(server.get(key), b'fresh')
+        finally:
+            release.set()
+            server.delete(key, other)
+
+    def test_sliding_expiry(self):
+        session_settings.SESSION_REDIS_SLIDING_EXPIRY = True
+        try:
+            self.session['key'] = 'value'
+            self.session.save()
+            key = self.session.get_real_stored_key(self.session.session_key)
+            self.session.server.expire(key, 10)
+
+            session = RedisSessionStore(self.session.session_key)
+            self.assertEqual(session['key'], 'value')
+            self.assertGreater(session.server.ttl(key), 10)
+            # unchanged: the save does not even touch it.
+            session.server.delete(key)
+            session.save()
+            self.assertFalse(session.server.exists(key))
+
+            # sessions with their own expiry keep it.
+            session.set_expiry(60)
+            session.save()
+            session = RedisSessionStore(self.session.session_key)
+            self.assertEqual(session['key'], 'value')
+            self.assertTrue(0 < session.server.ttl(key) <= 60)
+        finally:
+            session_settings.SESSION_REDIS_SLIDING_EXPIRY = False
+
+    def test_sweep_requires_prefix(self):
+        server = self.session.server
+        index_key = self.session.get_real_stored_key('user:1')
+        server.sadd(index_key, 'session-key')
+        prefix = session_settings.SESSION_REDIS_PREFIX
+        session_settings.SESSION_REDIS_PREFIX = ''
+        try:
+            server.set('unrelated', 'value')
+            RedisSessionStore.clear_expired()
+            self.assertTrue(server.exists('unrelated'))
+            with self.assertRaises(management.CommandError):
+                management.call_command('sweepsessions', no_ttl=True, undecodable=True)
+            self.assertTrue(server.exists('unrelated'))
+        finally:
+            session_settings.SESSION_REDIS_PREFIX = prefix
+            server.delete('unrelated')
+        # sets are not sessions.
+        RedisSessionStore.clear_expired()
+        self.assertTrue(server.exists(index_key))
+        server.delete(index_key)